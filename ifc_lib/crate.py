@@ -0,0 +1,132 @@
+# Bring up of several cards at once
+#
+# Each card is set up by a separate worker with its own register binding, so
+# that the time to bring up a crate is set by the slowest card rather than the
+# sum of all cards.  Workers are processes by default, or threads if requested.
+
+import io
+import sys
+import time
+import traceback
+import contextlib
+import concurrent.futures
+from collections import namedtuple
+
+from .gddr6_lib import pipeline
+from .gddr6_lib import calibration
+
+
+# Result of bringing up one card.  stages is a list of StageResult for each
+# stage completed or attempted, setup is the SetupResult from SGRAM setup or
+# None if this failed, error is None on success, and log is the output
+# printed while setting up the card
+CardResult = namedtuple('CardResult',
+    ['address', 'ok', 'seconds', 'stages', 'setup', 'error', 'log'])
+
+
+# Configures the SYS LMK, first ensuring that the SGRAM is in reset and the
+# controller is disabled.  Returns whether the PLLs lock.
+def setup_sys_lmk(top, sg, overclock = False):
+    # LMK support requires fpga_lib, so is only imported when needed
+    from . import lmk04616
+
+    sg.CONFIG._write_fields_rw(
+        CK_RESET_N = 0, SG_RESET_N = 0,
+        ENABLE_CONTROL = 0, ENABLE_REFRESH = 0, ENABLE_AXI = 0)
+    raw_lmk = lmk04616.RawLMK(top.LMK04616, 'sys')
+    config = lmk04616.create_sys_config(overclock, False)
+    lmk = lmk04616.setup_lmk(raw_lmk, config)
+    return lmk04616.wait_locked(lmk, config)
+
+
+# Brings up a single card, catching any failure.  open is called with the card
+# address and returns (top, sg) as for bind_ifc_1412.open().  Output is
+# captured in the result if capture is set, which is only safe if each card is
+# set up in a separate process.
+def bring_up(open, address, lmk = True, overclock = False,
+        calibration_dir = None, report = None, quiet = 1, capture = True):
+    start = time.time()
+    stages = pipeline.Stages(False)
+    setup = None
+    error = None
+    log = io.StringIO()
+    if capture:
+        output = contextlib.redirect_stdout(log)
+    else:
+        output = contextlib.nullcontext()
+    try:
+        with output:
+            top, sg = open(address)
+            if lmk:
+                locked = stages.run(
+                    'setup-lmk', setup_sys_lmk, top, sg, overclock)
+                assert locked, 'SYS LMK not locked'
+            calibration_file = None
+            if calibration_dir:
+                calibration_file = calibration.calibration_file(
+                    calibration_dir, top, address)
+            setup = pipeline.setup_sgram(sg,
+                calibration_file, report, quiet = quiet, stages = stages)
+    except Exception as e:
+        error = '%s: %s' % (type(e).__name__, e)
+        if quiet < 1:
+            print(traceback.format_exc(), file = log)
+    return CardResult(address, error is None, time.time() - start,
+        stages.stages, setup, error, log.getvalue())
+
+
+# Brings up all the given cards in parallel and returns a list of CardResult
+# in the order of addresses.  If report is given it is a format string used to
+# name the report for each card, for example 'report-%s'.  When using threads
+# output from each card is printed as it happens instead of being captured.
+def bring_up_crate(open, addresses, lmk = True, overclock = False,
+        calibration_dir = None, report = None, quiet = 1,
+        jobs = None, threads = False):
+    if threads:
+        Executor = concurrent.futures.ThreadPoolExecutor
+    else:
+        Executor = concurrent.futures.ProcessPoolExecutor
+    with Executor(max_workers = jobs or len(addresses)) as executor:
+        futures = [
+            executor.submit(bring_up, open, address, lmk, overclock,
+                calibration_dir, report and report % address, quiet,
+                not threads)
+            for address in addresses]
+        return [future.result() for future in futures]
+
+
+# Prints a combined report for all cards: one line per card with the stage
+# timings followed by the training results or failure
+def print_crate_report(results, seconds = None, file = sys.stdout):
+    names = []
+    for result in results:
+        for stage in result.stages:
+            if stage.name not in names:
+                names.append(stage.name)
+
+    print('%-8s %-4s %7s' % ('card', '', 'total'),
+        ' '.join('%11s' % name for name in names), file = file)
+    for result in results:
+        times = {stage.name: stage.seconds for stage in result.stages}
+        print('%-8s %-4s %7.3f' % (
+            result.address, 'ok' if result.ok else 'FAIL', result.seconds),
+            ' '.join(
+                '%11.3f' % times[name] if name in times else '%11s' % '-'
+                for name in names), file = file)
+
+    for result in results:
+        if result.ok:
+            setup = result.setup
+            print('%-8s CA phase %d, read window %d to %d, '
+                'write window %d to %d, %.1f degrees' % (
+                    result.address, setup.ca_phase,
+                    setup.read_windows.min(), setup.read_windows.max(),
+                    setup.write_windows.min(), setup.write_windows.max(),
+                    setup.vendor_id.temperatures.mean()), file = file)
+        else:
+            print('%-8s %s' % (result.address, result.error), file = file)
+
+    if seconds is not None:
+        print('%d of %d cards ok in %.3f s, slowest card %.3f s' % (
+            sum(result.ok for result in results), len(results), seconds,
+            max(result.seconds for result in results)), file = file)
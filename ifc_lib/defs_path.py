@@ -3,12 +3,14 @@
 import os
 import re
 import sys
+import functools
 
 
 # Returns path to top directory.
 #
 # This is trickier than it ought to be, as the path to __file__ may involve a
 # soft link in the path.
+@functools.lru_cache()
 def top_dir():
     this_file = os.path.realpath(__file__)
     return os.path.abspath(os.path.join(os.path.dirname(this_file), '..'))
@@ -17,14 +19,23 @@ def path_to(filename):
     return os.path.join(top_dir(), filename)
 
 
+# Returns dictionary of all keys in top level CONFIG file.  The file is only
+# read once.  As for make, the first assignment to a key is used.
+@functools.lru_cache()
+def read_config():
+    config = {}
+    with open(os.path.join(top_dir(), 'CONFIG'), 'r') as file:
+        for line in file:
+            match = re.fullmatch(r'(\w+) *= *(.*)\n', line)
+            if match:
+                config.setdefault(match[1], match[2])
+    return config
+
 # Returns value of specified key in top level CONFIG directory
 def get_config_key(key):
-    pattern = r'%s *= *(.*)\n' % key
-    for line in open(os.path.join(top_dir(), 'CONFIG'), 'r').readlines():
-        match = re.fullmatch(pattern, line)
-        if match:
-            return match[1]
-    assert False, 'Key %s not found in CONFIG file' % key
+    config = read_config()
+    assert key in config, 'Key %s not found in CONFIG file' % key
+    return config[key]
 
 
 # Adds the specified path to sys.path.  The path consists of a CONFIG file key
@@ -51,3 +62,13 @@ def module_defines(module):
     return os.path.join(
         top_dir(), 'modules', module, 'vhd',
         module + '_register_defines.in')
+
+
+# Directory for cached files, set by $IFC_1412_CACHE.  This currently holds
+# the compiled LMK register images.  The register defines files are not
+# cached: they are parsed by make_registers inside fpga_lib, and its parsed
+# register map is not available here to be serialised.
+def cache_dir():
+    return os.environ.get('IFC_1412_CACHE', os.path.join(
+        os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+        'ifc_1412'))
@@ -0,0 +1,309 @@
+# Bulk access to SGRAM through the AXI test buffer, and sampling of the AXI
+# statistics counters
+#
+# The AXI register bank of the gddr6_ip test image has a 64 row buffer, each
+# row holding 64 bytes written or read as 16 DATA words.  Each word written has
+# a 4 bit byte mask set through SETUP.BYTE_MASK, which is only rewritten when
+# the mask changes.  Transfers are split into chained AXI bursts at every 64
+# row page boundary, as a burst cannot cross a 4K byte boundary.  The number of
+# register accesses is counted so that the cost of each row transferred can be
+# reported.
+
+import time
+import json
+from collections import namedtuple
+
+import numpy
+
+from .. import regserver
+
+
+BUFFER_ROWS = 64
+ROW_BYTES = 64
+ROW_WORDS = 16
+ALL_BYTES = 2**64 - 1
+# Row addresses are 26 bits
+ADDRESS_ROWS = 2**26
+
+# Number of STATUS polls allowed while waiting for a transfer to complete
+BUSY_POLLS = 1000
+
+
+TransferStats = namedtuple('TransferStats',
+    ['rows', 'register_ops', 'ops_per_row'])
+
+
+# Returns the 4 bit mask for each word of each row from a byte mask of 64 bits
+# for each row, either a single value for all rows or an array of values
+def word_masks(byte_mask, rows):
+    masks = numpy.empty((rows, 1), dtype = numpy.uint64)
+    masks[:] = numpy.reshape(numpy.uint64(byte_mask), (-1, 1))
+    shifts = numpy.uint64(4) * numpy.arange(ROW_WORDS, dtype = numpy.uint64)
+    return (masks >> shifts) & numpy.uint64(0xF)
+
+
+# Returns (start, rows) for each burst of a transfer of count rows at address,
+# split so that no burst crosses a buffer page boundary
+def bursts(address, count):
+    assert 0 <= address and address + count <= ADDRESS_ROWS, \
+        'Address out of range'
+    start = 0
+    while start < count:
+        rows = min(BUFFER_ROWS - (address + start) % BUFFER_ROWS, count - start)
+        yield (start, rows)
+        start += rows
+
+
+class AxiBuffer:
+    def __init__(self, axi):
+        self.axi = axi
+        # Last value written to SETUP.BYTE_MASK, unknown until first written
+        self.byte_mask = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.rows = 0
+        self.register_ops = 0
+
+    def stats(self):
+        return TransferStats(
+            self.rows, self.register_ops,
+            self.register_ops / self.rows if self.rows else 0)
+
+    def __command(self, **fields):
+        self.axi.COMMAND._write_fields_wo(**fields)
+        self.register_ops += 1
+
+    def __read_words(self, count):
+        self.register_ops += count
+        data = self.axi.DATA
+        # Registers served by the register daemon can read several values in
+        # a single request
+        if hasattr(data, '_read_values'):
+            return data._read_values(count)
+        else:
+            return [data._value for _ in range(count)]
+
+    # Loads rows of data, an array of up to 64 rows of 64 bytes, into the
+    # buffer with the given byte mask.
+    def load(self, data, byte_mask = ALL_BYTES):
+        data = numpy.require(data, dtype = numpy.uint8).reshape(-1, ROW_BYTES)
+        rows = len(data)
+        assert rows <= BUFFER_ROWS, 'Too many rows for buffer'
+        words = data.view(numpy.uint32).tolist()
+        masks = word_masks(byte_mask, rows).tolist()
+
+        setup = self.axi.SETUP
+        register = self.axi.DATA
+        self.__command(START_WRITE = 1)
+        for row, row_masks in zip(words, masks):
+            for word, mask in zip(row, row_masks):
+                if mask != self.byte_mask:
+                    setup._write_fields_wo(BYTE_MASK = mask)
+                    self.byte_mask = mask
+                    self.register_ops += 1
+                register._value = word
+            self.register_ops += ROW_WORDS
+            self.__command(STEP_WRITE = 1)
+        self.rows += rows
+
+    # Returns count rows read from the buffer as an array of bytes
+    def readout(self, count):
+        data = numpy.empty((count, ROW_WORDS), dtype = numpy.uint32)
+        self.__command(START_READ = 1)
+        for row in range(count):
+            data[row] = self.__read_words(ROW_WORDS)
+            self.__command(STEP_READ = 1)
+        self.rows += count
+        return data.view(numpy.uint8)
+
+    def __wait(self, busy):
+        for _ in range(BUSY_POLLS):
+            status = self.axi.STATUS._get_fields()
+            self.register_ops += 1
+            if not getattr(status, busy):
+                return status
+        assert False, 'Timed out waiting for AXI transfer'
+
+    def __request(self, address, count):
+        self.axi.REQUEST._write_fields_wo(ADDRESS = address, LENGTH = count - 1)
+        self.register_ops += 1
+
+    # Writes the count rows loaded into the buffer to SGRAM starting at
+    # address, in rows
+    def start_write(self, address, count):
+        self.__request(address, count)
+        self.__command(START_AXI_WRITE = 1)
+        assert self.__wait('WRITE_BUSY').WRITE_OK, 'AXI write failed'
+
+    # Reads count rows from SGRAM at address into the buffer
+    def start_read(self, address, count):
+        self.__request(address, count)
+        self.__command(START_AXI_READ = 1)
+        assert self.__wait('READ_BUSY').READ_OK, 'AXI read failed'
+
+    # Writes any number of rows of data to SGRAM starting at address, with the
+    # byte mask for all rows or for each row
+    def write(self, address, data, byte_mask = ALL_BYTES):
+        data = numpy.require(data, dtype = numpy.uint8).reshape(-1, ROW_BYTES)
+        masks = numpy.empty(len(data), dtype = numpy.uint64)
+        masks[:] = byte_mask
+        for start, rows in bursts(address, len(data)):
+            end = start + rows
+            self.load(data[start:end], masks[start:end])
+            self.start_write(address + start, rows)
+
+    # Returns count rows of data read from SGRAM starting at address
+    def read(self, address, count):
+        data = []
+        for start, rows in bursts(address, count):
+            self.start_read(address + start, rows)
+            data.append(self.readout(rows))
+        return numpy.concatenate(data)
+
+
+# ------------------------------------------------------------------------------
+# Statistics
+
+# Names of the AXI.STATS counters
+STATS_NAMES = [
+    'write_frame_error',
+    'write_crc_error',
+    'write_last_error',
+    'write_address',
+    'write_transfer',
+    'write_data_beat',
+    'read_frame_error',
+    'read_crc_error',
+    'read_address',
+    'read_transfer',
+    'read_data_beat',
+]
+STATS = {name: n for n, name in enumerate(STATS_NAMES)}
+
+# Bytes transferred by each AXI data beat
+BEAT_BYTES = 64
+
+# The counters are 32 bits and wrap
+COUNTER_WRAP = 2**32
+# A counter cannot plausibly advance by more than half its range between
+# samples, so a larger change is taken to be a reset of the counters
+RESET_DELTA = COUNTER_WRAP // 2
+
+# Through the register daemon the counters are read in a single request
+def read_stats(axi):
+    return numpy.array(
+        regserver.read_values(
+            axi.STATS[i] for i in range(len(STATS_NAMES))),
+        dtype = numpy.uint32)
+
+
+# Polls the AXI counters and status together with the SG status, keeping the
+# last depth samples in a ring buffer.  Counter totals are extended to 64 bits
+# by accumulating the change at each sample, so samples must be taken often
+# enough that no counter advances by half its range between samples.  When
+# the counters are reset, for example by axi-exchange -S, the counts since the
+# reset are taken as the change.  The SG status event bits are cleared on
+# read, so are counted here.
+class StatsSampler:
+    def __init__(self, axi, sg, depth = 600):
+        self.axi = axi
+        self.sg = sg
+        self.depth = depth
+        self.times = numpy.zeros(depth)
+        self.totals = numpy.zeros(
+            (depth, len(STATS_NAMES)), dtype = numpy.int64)
+        self.count = 0
+        self.last_stats = read_stats(axi)
+        self.events = {'ck_ok_event': 0, 'fifo_ok_event': 0}
+        self.status = {}
+
+    def sample(self):
+        now = time.time()
+        stats = read_stats(self.axi)
+        axi_status = self.axi.STATUS._get_fields()
+        sg_status = self.sg.STATUS._get_fields()
+
+        delta = (stats.astype(numpy.int64) - self.last_stats) % COUNTER_WRAP
+        if (delta >= RESET_DELTA).any():
+            delta = stats.astype(numpy.int64)
+        self.last_stats = stats
+        previous = self.totals[(self.count - 1) % self.depth]
+        index = self.count % self.depth
+        self.times[index] = now
+        self.totals[index] = previous + delta if self.count else 0
+        self.count += 1
+
+        self.events['ck_ok_event'] += int(sg_status.CK_OK_EVENT)
+        self.events['fifo_ok_event'] += int(sg_status.FIFO_OK_EVENT != 0)
+        self.status = {
+            'ck_ok': int(sg_status.CK_OK),
+            'fifo_ok': int(sg_status.FIFO_OK == 3),
+            'write_busy': int(axi_status.WRITE_BUSY),
+            'read_busy': int(axi_status.READ_BUSY),
+            'write_ok': int(axi_status.WRITE_OK),
+            'read_ok': int(axi_status.READ_OK),
+        }
+
+    # Returns the times and counter totals of the oldest and newest samples
+    # within the last window samples
+    def __span(self, window):
+        window = min(window or self.depth, self.count, self.depth)
+        first = (self.count - window) % self.depth
+        last = (self.count - 1) % self.depth
+        return (
+            self.times[last] - self.times[first],
+            self.totals[last] - self.totals[first])
+
+    # Returns rates computed over the last window samples, or over all samples
+    # held if window is not given
+    def rates(self, window = None):
+        seconds, delta = self.__span(window)
+        if seconds <= 0:
+            return {}
+        delta = dict(zip(STATS_NAMES, delta.tolist()))
+        rates = {}
+        for direction in ['write', 'read']:
+            data = delta[direction + '_data_beat'] * BEAT_BYTES
+            errors = \
+                delta[direction + '_frame_error'] + \
+                delta[direction + '_crc_error']
+            rates[direction + '_bytes_per_second'] = data / seconds
+            rates[direction + '_transfers_per_second'] = \
+                delta[direction + '_transfer'] / seconds
+            rates[direction + '_errors_per_gb'] = \
+                errors / (data / 1e9) if data else 0
+        return rates
+
+    def totals_dict(self):
+        if self.count == 0:
+            return {}
+        totals = self.totals[(self.count - 1) % self.depth].tolist()
+        return dict(zip(STATS_NAMES, totals))
+
+    # Returns everything known as a single dictionary
+    def metrics(self, window = None):
+        return dict(
+            time = self.times[(self.count - 1) % self.depth],
+            totals = self.totals_dict(), events = self.events,
+            rates = self.rates(window), status = self.status)
+
+    def json_line(self, window = None):
+        return json.dumps(self.metrics(window))
+
+    # Returns metrics in the Prometheus text exposition format
+    def prometheus(self, window = None, labels = ''):
+        lines = []
+        def add(name, kind, value):
+            name = 'ifc_1412_axi_' + name
+            lines.append('# TYPE %s %s' % (name, kind))
+            lines.append('%s{%s} %s' % (name, labels, value))
+        for name, value in self.totals_dict().items():
+            add(name + '_total', 'counter', value)
+        for name, value in self.events.items():
+            add(name + '_total', 'counter', value)
+        for name, value in self.rates(window).items():
+            add(name, 'gauge', '%g' % value)
+        for name, value in self.status.items():
+            add(name, 'gauge', value)
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,142 @@
+# Storage of training results so that SGRAM setup can start from the last
+# calibration of a board instead of training from scratch
+#
+# Each board has a JSON file in a calibration directory holding one section per
+# training stage.  Boards are identified by the serial number in the MMC
+# mailbox where this is available, otherwise by card address.  A calibration
+# restored onto the wrong board is caught when it is validated, and the
+# failing pins or stages are then retrained.
+
+import os
+import json
+import bisect
+import numpy
+
+from .. import mailbox
+
+
+# Returns the key identifying the board.  top is the top level register bank
+# returned by bind_ifc_1412.open(), which may not include the mailbox
+def board_key(top, address):
+    mailbox_regs = getattr(top, 'MAILBOX', None)
+    if mailbox_regs is not None:
+        try:
+            return 'serial-%d' % mailbox.read_mmc_message(mailbox_regs).serial
+        except mailbox.MailboxError:
+            pass
+    return 'address-%s' % address
+
+def calibration_file(directory, top, address):
+    return os.path.join(
+        directory, 'gddr6-%s.json' % board_key(top, address))
+
+
+def load_calibration(filename):
+    try:
+        with open(filename) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+def _arrays(values):
+    return {
+        key: numpy.array(value) if isinstance(value, list) else value
+        for key, value in values.items()}
+
+# Returns the stored values for a single stage as a dictionary of arrays, or
+# None if the stage has not been saved.  If temperature is given the values are
+# selected from the temperature table by select_stage()
+def load_stage(filename, stage, temperature = None):
+    if temperature is not None:
+        return select_stage(filename, stage, temperature)
+    values = load_calibration(filename).get(stage)
+    if values is not None:
+        return _arrays(values)
+
+# Replaces the values stored for one stage, leaving other stages unchanged.  If
+# temperature is given the values are also stored as the table entry for this
+# temperature.  The file is replaced atomically so that an interrupted save
+# cannot lose the stored calibration.
+def save_stage(filename, stage, temperature = None, **values):
+    calibration = load_calibration(filename)
+    values = {
+        key: numpy.asarray(value).tolist() for key, value in values.items()}
+    calibration[stage] = values
+    if temperature is not None:
+        _add_entry(calibration, stage, temperature, values)
+    _write_calibration(filename, calibration)
+
+def _write_calibration(filename, calibration):
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok = True)
+    temp_file = filename + '.new'
+    with open(temp_file, 'w') as file:
+        json.dump(calibration, file, indent = 4)
+    os.replace(temp_file, filename)
+
+
+# Training results are also kept in a table indexed by the SGRAM temperature at
+# the time of training, with one entry per stage for each temperature step.
+# When a temperature is given the stored values are taken from this table,
+# interpolating between the nearest entries on either side.
+TEMPERATURE_STEP = 1
+
+# Values which are interpolated between entries, all other values are taken
+# from the nearest entry.  Delays are only interpolated on pins where the
+# bitslips of both entries agree.  The CA phase is not interpolated: the CA
+# stage is trained before the SGRAM temperature can be read, so it is always
+# loaded without a temperature, and its table is only kept to track drift.
+INTERPOLATE = ['delays']
+
+
+# Returns the list of entries for stage sorted by temperature, each entry is a
+# dictionary of values including the temperature
+def load_entries(filename, stage):
+    table = load_calibration(filename).get('temperatures', {})
+    return [_arrays(entry) for entry in table.get(stage, [])]
+
+# Adds an entry to the temperature table, replacing any entry in the same
+# temperature step
+def _add_entry(calibration, stage, temperature, values):
+    table = calibration.setdefault('temperatures', {})
+    step = round(temperature / TEMPERATURE_STEP)
+    entries = [
+        entry for entry in table.get(stage, [])
+        if round(entry['temperature'] / TEMPERATURE_STEP) != step]
+    entries.append(dict(values, temperature = float(temperature)))
+    table[stage] = sorted(entries, key = lambda entry: entry['temperature'])
+
+
+def _interpolate(low, high, temperature):
+    fraction = (temperature - low['temperature']) / \
+        (high['temperature'] - low['temperature'])
+    nearest = low if fraction <= 0.5 else high
+    result = dict(nearest)
+    same = True
+    if 'bitslips' in low and 'bitslips' in high:
+        same = low['bitslips'] == high['bitslips']
+    for key in INTERPOLATE:
+        if key in low and key in high:
+            value = numpy.round(
+                low[key] + fraction * (high[key] - low[key])).astype(int)
+            result[key] = numpy.where(same, value, nearest[key])
+    result['temperature'] = temperature
+    return result
+
+# Returns the stored values for stage at the given temperature, interpolated
+# between the entries either side, or from the nearest entry if the temperature
+# is outside the table.  If there are no entries the latest calibration saved
+# by save_stage is returned, or None.
+def select_stage(filename, stage, temperature):
+    entries = load_entries(filename, stage)
+    if not entries:
+        return load_stage(filename, stage)
+    temperatures = [entry['temperature'] for entry in entries]
+    index = bisect.bisect_left(temperatures, temperature)
+    if index == 0:
+        return entries[0]
+    elif index == len(entries):
+        return entries[-1]
+    elif temperatures[index] == temperature:
+        return entries[index]
+    else:
+        return _interpolate(entries[index - 1], entries[index], temperature)
@@ -1,115 +1,166 @@
 # Decode CA commands
 
-class DecodeCA:
-    def __init__(self, report_nop = False):
-        self.tick_count = 0
-        self.mask_count = 0
-        self.report_nop = report_nop
-
-    def __decode_command(self, ca0, ca1, ca3):
-        ca0_98 = ca0 >> 8
-        ca1_98 = ca1 >> 8
-        ca1_76 = (ca1 >> 6) & 3
-
-        if ca0_98 == 0 or ca0_98 == 1:
-            # Lx/xx -- ACT
-            self.report('ACT {:X} {:04X}'.format(
-                (ca0 >> 4) & 0xF,
-                (ca0 & 0xF) | (ca1 << 4)))
-        elif ca0_98 == 2:
-            # HL/xx -- NOP/MRS/REF/PRE
-            if ca1_98 == 0:
-                # HL/LL -- PRE
-                if (ca1 >> 4) & 1:
-                    self.report('PREab')
-                else:
-                    self.report('PREpb {:X}'.format((ca0 >> 4) & 0xF))
-            elif ca1_98 == 1:
-                # HL/LH -- REF
-                if (ca1 >> 4) & 1:
-                    self.report('REFab')
-                else:
-                    self.report('REFp2b {:X}'.format((ca0 >> 4) & 0x7))
-            elif ca1_98 == 2:
-                # HL/HL -- MRS
-                self.report('MRS {:X} {:03X}'.format(
-                    (ca0 >> 4) & 0xF,
-                    (ca0 & 0xF) | ((ca1 & 0xFF) << 4)))
-            elif ca1_98 == 3:
-                # HL/HH -- NOP
-                self.nop()
-        else: # 3
-            # HH/xx -- NOP/others
-            if ca1_98 == 0:
-                # HH/LL -- WRTR/WDM/WSM/WOM
-                if ca1_76 == 0:
-                    # HH/LLLL -- WOM
-                    self.report('WOM{:s} {:X} {:02X} {:04b}'.format(
-                        'A' if (ca1 >> 4) & 1 else '',
-                        (ca0 >> 4) & 0xF,
-                        (ca0 & 0xF) | ((ca1 & 7) << 4),
-                        ca3))
-                elif ca1_76 == 1:
-                    # HH/LLLH -- WSM
-                    self.report('WSM{:s} {:X} {:02X} {:04b}'.format(
-                        'A' if (ca1 >> 4) & 1 else '',
-                        (ca0 >> 4) & 0xF,
-                        (ca0 & 0xF) | ((ca1 & 7) << 4),
-                        ca3))
-                    self.mask_count = 2
-                elif ca1_76 == 2:
-                    # HH/LLHL -- WDM
-                    self.report('WDM{:s} {:X} {:02X} {:04b}'.format(
-                        'A' if (ca1 >> 4) & 1 else '',
-                        (ca0 >> 4) & 0xF,
-                        (ca0 & 0xF) | ((ca1 & 7) << 4),
-                        ca3))
-                    self.mask_count = 1
-                elif ca1_76 == 3:
-                    # HH/LLHH -- WRTR
-                    self.report('WRTR')
-            elif ca1_98 == 1:
-                # HH/LH -- RDTR/LDFF/RD
-                if ca1_76 == 0:
-                    # HH/LHLL -- RD
-                    self.report('RD{:s} {:X} {:02X}'.format(
-                        'A' if (ca1 >> 4) & 1 else '',
-                        (ca0 >> 4) & 0xF,
-                        (ca0 & 0xF) | ((ca1 & 7) << 4)))
-                elif ca1_76 == 1:
-                    # HH/LHLH -- invalid coding
-                    self.report('UNKNOWN')
-                elif ca1_76 == 2:
-                    # HH/LHHL -- LDFF
-                    self.report('LDFF {:X} {:03X}'.format(
-                        (ca0 >> 4) & 0xF,
-                        (ca0 & 0xF) | (ca1 & 0x3F) << 4))
-                elif ca1_76 == 3:
-                    # HH/LHHH -- RDTR
-                    self.report('RDTR')
-            elif ca1_98 == 2 or ca1_98 == 3:
-                # HH/Hx -- NOP
-                self.nop()
-
-    def __decode_mask(self, ca0, ca1):
-        if ca0 >> 8 == 3 and ca1 >> 8 == 3:
-            # Complement mask to show bytes being written as 1s
-            self.report('mask: {:04X}'.format(
-                (~ca0 & 0xFF) | ((~ca1 & 0xFF) << 8)))
-        else:
-            self.report('Malformed mask {:03X}:{:03X}'.format(ca0, ca1))
-        self.mask_count -= 1
-
-    def decode(self, ca):
-        if self.mask_count > 0:
-            self.__decode_mask(ca.RISING, ca.FALLING)
-        else:
-            self.__decode_command(ca.RISING, ca.FALLING, ca.CA3)
-        self.tick_count += 1
-
-    def report(self, string):
-        print('@{:2d}  {:s}'.format(self.tick_count, string))
-
-    def nop(self):
-        if self.report_nop:
-            report('NOP')
+import numpy
+
+
+# Command opcodes as returned in the opcode field by decode_ca
+OPCODE_NAMES = [
+    'NOP', 'ACT', 'PREpb', 'PREab', 'REFp2b', 'REFab', 'MRS',
+    'WOM', 'WOMA', 'WSM', 'WSMA', 'WDM', 'WDMA', 'WRTR',
+    'RD', 'RDA', 'LDFF', 'RDTR', 'UNKNOWN', 'MASK', 'MALFORMED']
+
+(NOP, ACT, PREpb, PREab, REFp2b, REFab, MRS,
+ WOM, WOMA, WSM, WSMA, WDM, WDMA, WRTR,
+ RD, RDA, LDFF, RDTR, UNKNOWN, MASK, MALFORMED) = range(len(OPCODE_NAMES))
+
+# Structure of decoded commands.  Fields not used by a command are zero:
+#   bank        Bank for ACT, PREpb, REFp2b, WOM, WSM, WDM, RD
+#   address     Row for ACT, column for WOM, WSM, WDM, RD, burst for LDFF
+#   mask        CA3 for WOM, WSM, WDM, byte mask for MASK
+#   mr          Mode register for MRS
+#   operand     Operand for MRS, data for LDFF, raw CA for MALFORMED
+COMMAND_DTYPE = numpy.dtype([
+    ('tick', numpy.int64),
+    ('opcode', numpy.uint8),
+    ('bank', numpy.uint8),
+    ('address', numpy.uint16),
+    ('mask', numpy.uint16),
+    ('mr', numpy.uint8),
+    ('operand', numpy.uint32)])
+
+
+# The command is determined by CA[9:8] on both edges, CA[7:6] and CA[4] on the
+# falling edge, which together form a 7 bit index into this table.
+def _classify(ca0_98, ca1_98, ca1_76, ca1_4):
+    if ca0_98 == 0 or ca0_98 == 1:
+        # Lx/xx -- ACT
+        return ACT
+    elif ca0_98 == 2:
+        # HL/LL -- PRE, HL/LH -- REF, HL/HL -- MRS, HL/HH -- NOP
+        return [
+            PREab if ca1_4 else PREpb,
+            REFab if ca1_4 else REFp2b,
+            MRS, NOP][ca1_98]
+    elif ca1_98 == 0:
+        # HH/LL -- WOM/WSM/WDM/WRTR
+        return [
+            WOMA if ca1_4 else WOM,
+            WSMA if ca1_4 else WSM,
+            WDMA if ca1_4 else WDM,
+            WRTR][ca1_76]
+    elif ca1_98 == 1:
+        # HH/LH -- RD/invalid/LDFF/RDTR
+        return [RDA if ca1_4 else RD, UNKNOWN, LDFF, RDTR][ca1_76]
+    else:
+        # HH/Hx -- NOP
+        return NOP
+
+_OPCODE_TABLE = numpy.array([
+    _classify(index >> 5, (index >> 3) & 3, (index >> 1) & 3, index & 1)
+    for index in range(128)], dtype = numpy.uint8)
+
+# Number of mask ticks following each opcode
+_MASK_TICKS = numpy.zeros(len(OPCODE_NAMES), dtype = int)
+_MASK_TICKS[[WSM, WSMA]] = 2
+_MASK_TICKS[[WDM, WDMA]] = 1
+
+
+# Marks the ticks following WSM and WDM commands as masks.  Only the masking
+# commands need to be visited, and a mask tick never starts another mask.
+def _find_masks(opcode):
+    masks = numpy.zeros(len(opcode), dtype = bool)
+    last_mask = -1
+    for tick in numpy.flatnonzero(_MASK_TICKS[opcode]):
+        if tick > last_mask:
+            last_mask = tick + _MASK_TICKS[opcode[tick]]
+            masks[tick + 1 : last_mask + 1] = True
+    return masks
+
+
+# Decodes arrays of RISING, FALLING and CA3 values, as captured from the CA
+# register, into an array of COMMAND_DTYPE records, one per tick.  The tick
+# field counts from start.
+def decode_ca(rising, falling, ca3 = 0, start = 0):
+    ca0 = numpy.asarray(rising, dtype = numpy.uint32)
+    ca1 = numpy.asarray(falling, dtype = numpy.uint32)
+    ca3 = numpy.broadcast_to(ca3, ca0.shape)
+
+    index = \
+        ((ca0 >> 8) << 5) | ((ca1 >> 8) << 3) | \
+        (((ca1 >> 6) & 3) << 1) | ((ca1 >> 4) & 1)
+    opcode = _OPCODE_TABLE[index]
+
+    commands = numpy.zeros(len(ca0), dtype = COMMAND_DTYPE)
+    commands['tick'] = numpy.arange(start, start + len(ca0))
+
+    bank = (ca0 >> 4) & 0xF
+    row = (ca0 & 0xF) | (ca1 << 4) | (((ca0 >> 8) & 1) << 14)
+    column = (ca0 & 0xF) | ((ca1 & 7) << 4)
+    operand = (ca0 & 0xF) | ((ca1 & 0xFF) << 4)
+    data = (ca0 & 0xF) | ((ca1 & 0x3F) << 4)
+
+    act = opcode == ACT
+    mrs = opcode == MRS
+    ldff = opcode == LDFF
+    write = numpy.isin(opcode, [WOM, WOMA, WSM, WSMA, WDM, WDMA])
+    access = write | numpy.isin(opcode, [RD, RDA])
+    commands['bank'] = numpy.select(
+        [act | access | (opcode == PREpb), opcode == REFp2b],
+        [bank, bank & 7])
+    # LDFF carries its burst number in the bank position
+    commands['address'] = numpy.select(
+        [act, access, ldff], [row, column, bank])
+    commands['mask'] = numpy.where(write, ca3, 0)
+    commands['mr'] = numpy.where(mrs, bank, 0)
+    commands['operand'] = numpy.select([mrs, ldff], [operand, data])
+
+    # Mask ticks replace whatever command they would otherwise decode as
+    masks = _find_masks(opcode)
+    if masks.any():
+        well_formed = (ca0 >> 8 == 3) & (ca1 >> 8 == 3)
+        opcode = numpy.where(masks,
+            numpy.where(well_formed, MASK, MALFORMED), opcode)
+        for field in ['bank', 'address', 'mask', 'mr', 'operand']:
+            commands[field][masks] = 0
+        mask = (~ca0 & 0xFF) | ((~ca1 & 0xFF) << 8)
+        commands['mask'][masks & well_formed] = mask[masks & well_formed]
+        malformed = masks & ~well_formed
+        commands['operand'][malformed] = \
+            ((ca0 << 10) | ca1)[malformed]
+    commands['opcode'] = opcode
+    return commands
+
+
+# Formats a single decoded command as text
+def format_command(command):
+    opcode = command['opcode']
+    name = OPCODE_NAMES[opcode]
+    bank = command['bank']
+    address = command['address']
+    if opcode == ACT:
+        return 'ACT {:X} {:04X}'.format(bank, address)
+    elif opcode in [PREpb, REFp2b]:
+        return '{:s} {:X}'.format(name, bank)
+    elif opcode == MRS:
+        return 'MRS {:X} {:03X}'.format(command['mr'], command['operand'])
+    elif opcode in [WOM, WOMA, WSM, WSMA, WDM, WDMA]:
+        return '{:s} {:X} {:02X} {:04b}'.format(
+            name, bank, address, command['mask'])
+    elif opcode in [RD, RDA]:
+        return '{:s} {:X} {:02X}'.format(name, bank, address)
+    elif opcode == LDFF:
+        return 'LDFF {:X} {:03X}'.format(address, command['operand'])
+    elif opcode == MASK:
+        return 'mask: {:04X}'.format(command['mask'])
+    elif opcode == MALFORMED:
+        operand = command['operand']
+        return 'Malformed mask {:03X}:{:03X}'.format(
+            operand >> 10, operand & 0x3FF)
+    else:
+        return name
+
+def print_commands(commands, report_nop = False):
+    for command in commands:
+        if report_nop or command['opcode'] != NOP:
+            print('@{:2d}  {:s}'.format(
+                command['tick'], format_command(command)))
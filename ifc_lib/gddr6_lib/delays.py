@@ -1,5 +1,8 @@
 # Control over delays
 
+import numpy
+
+
 TARGET_IDELAY = 0
 TARGET_ODELAY = 1
 TARGET_IBITSLIP = 2
@@ -81,3 +84,93 @@ def read_ibitslip(sg, address):
 
 def read_obitslip(sg, address):
     return read_delay(sg, TARGET_OBITSLIP, address)
+
+
+# Number of pins controlled by each delay target
+DELAY_COUNTS = {
+    TARGET_IDELAY: 80,
+    TARGET_ODELAY: 72,
+    TARGET_IBITSLIP: 80,
+    TARGET_OBITSLIP: 72,
+}
+
+# Number of pins read back on each update in verify mode
+VERIFY_COUNT = 4
+
+
+# Keeps a shadow copy of all delay settings so that delays can be changed
+# without reading back the current setting first.  The shadow for each target
+# is read from hardware when first needed, and is only read again after a call
+# to sync().  In verify mode a few pins are read back after every update to
+# check that the shadow still matches the hardware.
+class DelayBank:
+    def __init__(self, sg, verify = False):
+        self.sg = sg
+        self.verify = verify
+        self.__shadow = {}
+        self.__verify_pin = 0
+
+    # Discards the shadow so that delays are read from hardware again, must be
+    # called if delays are changed by anything else, for instance a PHY reset
+    def sync(self):
+        self.__shadow = {}
+
+    def __get_shadow(self, target):
+        if target not in self.__shadow:
+            self.__shadow[target] = numpy.array([
+                read_delay(self.sg, target, address)
+                for address in range(DELAY_COUNTS[target])])
+        return self.__shadow[target]
+
+    def get(self, target):
+        return self.__get_shadow(target).copy()
+
+    # Sets delays for all pins of the selected target, only changed pins are
+    # written.  delays can be a single value or an array with one value per pin
+    # and pins can be a boolean array selecting which pins to update
+    def set(self, target, delays, pins = None):
+        shadow = self.__get_shadow(target)
+        delays = numpy.broadcast_to(delays, shadow.shape)
+        if pins is not None:
+            delays = numpy.where(pins, delays, shadow)
+        limit = 8 if target in [TARGET_IBITSLIP, TARGET_OBITSLIP] else 512
+        assert ((0 <= delays) & (delays < limit)).all(), 'Delay out of range'
+        changed = numpy.flatnonzero(delays != shadow)
+        for address in map(int, changed):
+            delay = int(delays[address])
+            if limit == 8:
+                self.sg.DELAY._write_fields_wo(
+                    ADDRESS = address, TARGET = target,
+                    DELAY = delay, ENABLE_WRITE = 1)
+            else:
+                step_delay(self.sg, target, address, delay - shadow[address])
+            shadow[address] = delay
+        if self.verify and len(changed) > 0:
+            self.check(target, changed)
+
+    # Reads back a few of the given pins, rotating through them on successive
+    # calls, and checks that the hardware agrees with the shadow
+    def check(self, target, addresses = None):
+        shadow = self.__get_shadow(target)
+        if addresses is None:
+            addresses = numpy.arange(len(shadow))
+        for n in range(min(VERIFY_COUNT, len(addresses))):
+            address = int(
+                addresses[(self.__verify_pin + n) % len(addresses)])
+            delay = read_delay(self.sg, target, address)
+            assert delay == shadow[address], \
+                'Delay %d:%d is %d, expected %d' % (
+                    target, address, delay, shadow[address])
+        self.__verify_pin += VERIFY_COUNT
+
+    def set_idelays(self, delays, pins = None):
+        self.set(TARGET_IDELAY, delays, pins)
+
+    def set_odelays(self, delays, pins = None):
+        self.set(TARGET_ODELAY, delays, pins)
+
+    def set_ibitslips(self, bitslips, pins = None):
+        self.set(TARGET_IBITSLIP, bitslips, pins)
+
+    def set_obitslips(self, bitslips, pins = None):
+        self.set(TARGET_OBITSLIP, bitslips, pins)
@@ -80,3 +80,21 @@ def print_condensed_data_dbi(data, dbi, offset = 0):
             ' '.join(['%04X' % v if g else '----'
                 for v, g in zip(data, data_good)]), ' '
             '%02X' % e_in if e_in_good else ' --')
+
+
+# Prints the bits of each byte, earliest bit first
+def print_bits(offset, bytes):
+    print('%2d' % offset, ' '.join(f'{byte:08b}'[::-1] for byte in bytes))
+
+def show_channel(data, channel):
+    for n in range(0, 16):
+        ix = n + 16 * channel
+        print_bits(ix, data[:, ix])
+
+# Formats an array of per pin booleans as groups of 0 and 1
+def show_match(match):
+    # Convert array of booleans into a string of 0 or 1
+    show = ''.join('1' if m else '0' for m in match)
+    # Split the string into four groups of 16 and two of 8 for ease of display
+    splits = [0, 16, 32, 48, 64, 72, 80]
+    return ' '.join(show[l:r] for l, r in zip(splits[:-1], splits[1:]))
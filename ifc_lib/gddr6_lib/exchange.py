@@ -1,32 +1,140 @@
 # Commands for talking to SG RAM
 
 from collections import namedtuple
+import hashlib
+import weakref
 import numpy
 
 from .commands import NOP
 
 
+# Packs the fields of the EXCHANGE.CA register into a single word.  This must
+# match the field layout of CA in gddr6_register_defines.in
+def _pack_ca(command, cke_n, ca3, oe):
+    return \
+        (command[0] & 0x3FF) | \
+        ((command[1] & 0x3FF) << 10) | \
+        ((ca3 & 0xF) << 20) | \
+        ((int(cke_n) & 1) << 24) | \
+        ((int(oe) & 1) << 25)
+
+
+# A sequence of commands and DQ data for a single exchange, encoded once into
+# packed arrays so that it can be uploaded repeatedly without being rebuilt.  A
+# program is built with the same command() and delay() calls as _Exchange and
+# is then frozen by compile(), which returns a shared instance for programs with
+# identical content.
+class ExchangeProgram:
+    MAX_COMMANDS = 64
+
+    # Cache of compiled programs indexed by content.  Only programs still in
+    # use are held, so the cache does not grow for the life of the process.
+    _programs = weakref.WeakValueDictionary()
+
+    def __init__(self):
+        self.__commands = []
+        self.compiled = False
+
+    def __len__(self):
+        if self.compiled:
+            return len(self.ca)
+        else:
+            return len(self.__commands)
+
+    def capacity(self):
+        return self.MAX_COMMANDS - len(self.__commands)
+
+    # Adds a command to the program.  If data is specified it must be 16 words
+    # of DQ data, and dbi can be 2 words of DBI training data.
+    def command(self, command = NOP, cke_n = 0, ca3 = 0, oe = 0,
+            data = None, dbi = None):
+        assert not self.compiled, 'Cannot modify compiled program'
+        assert len(self.__commands) < self.MAX_COMMANDS, 'Program is full'
+        if data is not None:
+            data = tuple(int(d) & 0xFFFFFFFF for d in data)
+            assert len(data) == 16, 'Must specify complete row of DQ data'
+        if dbi is not None:
+            dbi = tuple(int(d) & 0xFFFFFFFF for d in dbi)
+            assert len(dbi) == 2, 'Must specify complete row of DBI data'
+        self.__commands.append(
+            (_pack_ca(command, cke_n, ca3, oe), data, dbi))
+
+    # Adds the requested number of NOPs
+    def delay(self, delay):
+        for n in range(delay):
+            self.command(NOP)
+
+    # Packs the program into arrays and returns the cached program with the
+    # same content if there is one.  The command list is discarded, as the
+    # program is uploaded from the arrays.
+    def compile(self):
+        if self.compiled:
+            return self
+
+        count = len(self.__commands)
+        assert count > 0, 'Empty program'
+        self.ca = numpy.zeros(count, dtype = numpy.uint32)
+        self.dq = numpy.zeros((count, 16), dtype = numpy.uint32)
+        self.dbi = numpy.zeros((count, 2), dtype = numpy.uint32)
+        self.has_dq = numpy.zeros(count, dtype = bool)
+        self.has_dbi = numpy.zeros(count, dtype = bool)
+        for n, (ca, data, dbi) in enumerate(self.__commands):
+            self.ca[n] = ca
+            if data is not None:
+                self.dq[n] = data
+                self.has_dq[n] = True
+            if dbi is not None:
+                self.dbi[n] = dbi
+                self.has_dbi[n] = True
+        self.__commands = None
+        self.compiled = True
+
+        digest = hashlib.sha1()
+        for array in [self.ca, self.dq, self.dbi, self.has_dq, self.has_dbi]:
+            digest.update(array.tobytes())
+        self.key = digest.hexdigest()
+        return self._programs.setdefault(self.key, self)
+
+    # Writes the program into the exchange buffers.  The write counter must
+    # already have been reset.
+    def upload(self, sg):
+        assert self.compiled, 'Program must be compiled before upload'
+        rows = zip(
+            self.ca.tolist(), self.dq.tolist(), self.dbi.tolist(),
+            self.has_dq.tolist(), self.has_dbi.tolist())
+        for ca, data, dbi, has_dq, has_dbi in rows:
+            if has_dq:
+                for d in data:
+                    sg.DQ._value = d
+            if has_dbi:
+                for d in dbi:
+                    sg.DBI._value = d
+            sg.CA._value = ca
+
 
 class _Exchange:
     MAX_COMMANDS = 64
 
-    _instance = [None]
+    # Only one exchange can be used with each card, but separate cards are
+    # independent and can be driven at the same time
+    _instances = {}
 
     def __init__(self, sg):
-        assert self._instance[0] is None, \
+        assert id(sg) not in self._instances, \
             'Cannot create multiple Exchange instances'
         self.sg = sg
         self.reset()
-        self._instance[0] = self
+        self._instances[id(sg)] = self
 
     def discard(self):
+        del self._instances[id(self.sg)]
         del self.sg
-        self._instance[0] = None
 
     def reset(self):
         self.sg.COMMAND._write_fields_wo(START_WRITE = 1)
         self.count = 0
         self.exchanged = False
+        self.program = None
 
     def capacity(self):
         return self.MAX_COMMANDS - self.count
@@ -41,6 +149,18 @@ class _Exchange:
             RISING = command[0], FALLING = command[1],
             CA3 = ca3, CKE_N = cke_n, OUTPUT_ENABLE = oe)
         self.count += 1
+        self.program = None
+
+    # Loads an exchange program into the buffers ready for exchange.  If the
+    # same program is still loaded from a previous call the upload is skipped.
+    def load(self, program):
+        program = program.compile()
+        if program is not self.program:
+            self.reset()
+            program.upload(self.sg)
+            self.count = len(program)
+            self.program = program
+        self.exchanged = False
 
     # Writes the requested number of NOPs
     def delay(self, delay):
@@ -85,6 +205,41 @@ class _Exchange:
             self.sg.COMMAND._write_fields_wo(STEP_READ = 1)
         return (dbi.view('uint8'), edc.view('uint8'))
 
+    # Converts a row selection into a boolean mask over the captured rows.  The
+    # selection can be None for all rows, a slice, an array of row indices, or
+    # a boolean mask.
+    def __select_rows(self, rows):
+        selected = numpy.zeros(self.count, dtype = bool)
+        if rows is None:
+            selected[:] = True
+        else:
+            selected[rows] = True
+        return selected
+
+    # Reads DQ, DBI and EDC together in a single walk through the captured
+    # rows.  Only the selected rows are read out, the remaining rows are
+    # stepped over and returned as zeros, and the walk stops at the last
+    # selected row.
+    def read_rows(self, rows = None):
+        assert self.exchanged, 'No data to read'
+        selected = self.__select_rows(rows)
+        data = numpy.zeros((self.count, 16), dtype = numpy.uint32)
+        dbi = numpy.zeros((self.count, 2), dtype = numpy.uint32)
+        edc = numpy.zeros((self.count, 2), dtype = numpy.uint32)
+
+        self.sg.COMMAND._write_fields_wo(START_READ = 1)
+        row = 0
+        for i in numpy.flatnonzero(selected):
+            for _ in range(i - row):
+                self.sg.COMMAND._write_fields_wo(STEP_READ = 1)
+            row = i
+            for j in range(16):
+                data[i, j] = self.sg.DQ._value
+            for j in range(2):
+                dbi[i, j] = self.sg.DBI._value
+                edc[i, j] = self.sg.EDC._value
+        return (data.view('uint8'), dbi.view('uint8'), edc.view('uint8'))
+
     def run(self):
         self.exchange()
         return self.read_data()
@@ -97,20 +252,6 @@ class _Exchange:
         self.exchange()
 
 
-# Used to send a stream of commands with a mandatory inter-command spacing
-class Stream:
-    def __init__(self, exchange, delay):
-        self.exchange = exchange
-        self.delay = delay
-
-    def command(self, command):
-        if self.exchange.capacity() < self.delay:
-            self.exchange.exchange()
-            self.exchange.reset()
-        self.exchange.command(command)
-        self.exchange.delay(self.delay - 1)
-
-
 def send_command(sg, command):
     exchange = _Exchange(sg)
     exchange.command(command)
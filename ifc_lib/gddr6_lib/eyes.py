@@ -0,0 +1,117 @@
+# Analysis of data eyes from delay sweeps
+#
+# A sweep is a boolean matrix indexed by (delay, pin) marking which delays
+# returned correct data on each pin.  Eyes are runs of passing delays, and are
+# found for all pins at once by taking differences along the delay axis.
+#
+# Raw sweeps can be saved to compressed .npz files so that eye detection and
+# search strategies can be rerun against recorded data without hardware.
+
+from collections import namedtuple
+
+import numpy
+
+
+# Returns the start (inclusive) and end (exclusive) of every run of passing
+# delays as three arrays (pins, starts, ends), ordered by pin and then start.
+# If wrap is set a run touching the top of the range continues from delay 0.
+def find_runs(matches, wrap = False):
+    delays, pins = matches.shape
+    if wrap:
+        # Find runs over two copies of the range and keep those which start in
+        # the first copy, except for the tail of a run wrapping round
+        matches = numpy.concatenate((matches, matches))
+    padding = numpy.zeros((1, pins), dtype = numpy.int8)
+    diffs = numpy.diff(
+        numpy.concatenate((padding, numpy.int8(matches), padding)), axis = 0)
+    # Transpose so that nonzero() returns results ordered by pin.  The starts
+    # and ends of runs on the same pin then line up
+    start_pins, starts = numpy.nonzero(diffs.T == 1)
+    _, ends = numpy.nonzero(diffs.T == -1)
+    if wrap:
+        wrapped = matches[delays - 1, start_pins]
+        keep = (starts < delays) & ((starts > 0) | ~wrapped)
+        # A pin passing everywhere has a single run which must be kept
+        keep |= (starts == 0) & (ends == 2 * delays)
+        start_pins, starts, ends = start_pins[keep], starts[keep], ends[keep]
+        ends = numpy.minimum(ends, starts + delays)
+    return (start_pins, starts, ends)
+
+
+# Returns (centres, lengths) of the longest eye on each pin, or (0, 0) for pins
+# with no eye.  Runs shorter than min_width are ignored, and the first of the
+# longest runs is chosen.  With wrap set centres are reduced modulo the range.
+def find_eyes(matches, wrap = False, min_width = 1):
+    delays, pins = matches.shape
+    run_pins, starts, ends = find_runs(matches, wrap)
+    lengths = ends - starts
+    keep = lengths >= min_width
+    run_pins, starts, ends, lengths = \
+        run_pins[keep], starts[keep], ends[keep], lengths[keep]
+
+    # Sort by pin, then longest first, then earliest first and pick the first
+    # run for each pin
+    order = numpy.lexsort((starts, -lengths, run_pins))
+    found, first = numpy.unique(run_pins[order], return_index = True)
+    best = order[first]
+
+    centres = numpy.zeros(pins, dtype = int)
+    widths = numpy.zeros(pins, dtype = int)
+    centres[found] = (starts[best] + ends[best]) // 2
+    widths[found] = lengths[best]
+    if wrap:
+        centres %= delays
+    return (centres, widths)
+
+
+# Returns the byte lane of each pin.  Pins are numbered as for the delay
+# registers: 64 DQ pins in eight bytes followed by one DBI pin for each byte and
+# then, for reads only, one EDC pin for each byte.
+def byte_lanes(pins):
+    lanes = numpy.arange(pins) // 8
+    lanes[64:] = numpy.arange(pins - 64) % 8
+    return lanes
+
+
+LaneStats = namedtuple('LaneStats',
+    ['min_window', 'max_window', 'median_window', 'skew'])
+
+# Computes window statistics for each byte lane from the (centres, lengths)
+# returned by find_eyes.  Skew is the spread of eye centres across the lane.
+def lane_stats(centres, lengths):
+    # Gather pins into a (lane, pin in lane) matrix
+    lanes = numpy.argsort(byte_lanes(len(lengths)), kind = 'stable')
+    lanes = lanes.reshape(8, -1)
+    lengths = lengths[lanes]
+    centres = centres[lanes]
+    return LaneStats(
+        lengths.min(1), lengths.max(1), numpy.median(lengths, 1),
+        centres.max(1) - centres.min(1))
+
+def print_lane_stats(stats):
+    print('Lane   min   max  median  skew')
+    for lane, row in enumerate(zip(*stats)):
+        print('%4d %5d %5d %7.1f %5d' % ((lane,) + row))
+
+
+# Saves a sweep matrix together with any extra arrays or values describing it
+def save_sweep(filename, matches, **extra):
+    numpy.savez_compressed(filename, matches = matches, **extra)
+
+# Returns the sweep matrix and a dictionary of extra values from save_sweep
+def load_sweep(filename):
+    with numpy.load(filename) as data:
+        extra = {key: data[key] for key in data.files if key != 'matches'}
+        return (data['matches'], extra)
+
+
+# Returns a test function, as used by the search strategies, which looks up
+# results in a recorded sweep.  Delays outside the sweep fail.
+def replay(matches):
+    delays, pins = matches.shape
+    def test(tested):
+        tested = numpy.asarray(tested)
+        inside = (0 <= tested) & (tested < delays)
+        return inside & matches[
+            numpy.clip(tested, 0, delays - 1), numpy.arange(pins)]
+    return test
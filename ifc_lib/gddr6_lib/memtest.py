@@ -0,0 +1,249 @@
+# Memory test for the SGRAM device
+#
+# Test patterns are computed from the address of each 64 bit word, so any block
+# can be written or checked on its own and the device can be split between
+# parallel workers.  Mismatched bits are mapped back to the DQ pin carrying
+# them so that errors can be attributed to a channel and byte lane.
+#
+# Data is mapped onto pins following the layout used by axi-exchange to show
+# AXI data: each 64 byte block is split into four channels of 16 bytes, and
+# within each channel the bytes alternate between the two byte lanes of the
+# channel, with bit n of each byte carried on pin n of the byte lane.  Pins are
+# numbered as for the delay registers, so pin // 16 is the channel and pin // 8
+# is the byte lane.
+
+import os
+import concurrent.futures
+
+import numpy
+
+
+BLOCK_BYTES = 64
+DQ_PINS = 64
+
+# DQ pin carrying each bit of each byte of a 64 byte block, indexed by
+# [byte, bit]
+def _make_pin_map():
+    byte = numpy.arange(BLOCK_BYTES)
+    channel = byte // 16
+    lane = 2 * channel + byte % 2
+    return 8 * lane[:, None] + numpy.arange(8)[None, :]
+
+PIN_MAP = _make_pin_map()
+
+
+# ------------------------------------------------------------------------------
+# Patterns
+#
+# Each pattern is a function returning the 64 bit words for the given array of
+# word numbers (byte address // 8).
+
+# A 64 bit hash of each word number, using the SplitMix64 mixing function
+def _counter_hash(words, seed):
+    # The seed offset is computed in Python as numpy warns on scalar overflow
+    z = words + numpy.uint64(0x9E3779B97F4A7C15 * (seed + 1) & (2**64 - 1))
+    z = (z ^ (z >> numpy.uint64(30))) * numpy.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> numpy.uint64(27))) * numpy.uint64(0x94D049BB133111EB)
+    return z ^ (z >> numpy.uint64(31))
+
+def _walking_ones(words, seed):
+    return numpy.uint64(1) << ((words + numpy.uint64(seed)) % numpy.uint64(64))
+
+def _walking_zeros(words, seed):
+    return ~_walking_ones(words, seed)
+
+# Alternate bits are set, inverting on every 64 byte block so that each pin
+# sees alternating values in successive blocks
+def _checkerboard(words, seed):
+    flip = ((words // numpy.uint64(8) + numpy.uint64(seed)) & numpy.uint64(1))
+    return numpy.where(flip,
+        numpy.uint64(0xAAAAAAAAAAAAAAAA), numpy.uint64(0x5555555555555555))
+
+def _solid(value):
+    def solid(words, seed):
+        return numpy.full(len(words), value, dtype = numpy.uint64)
+    return solid
+
+PATTERNS = {
+    'counter':          _counter_hash,
+    'walking_ones':     _walking_ones,
+    'walking_zeros':    _walking_zeros,
+    'checkerboard':     _checkerboard,
+}
+
+# Backgrounds used by the March test
+_ZEROS = _solid(0)
+_ONES = _solid(0xFFFFFFFFFFFFFFFF)
+
+
+# Returns the expected contents of length bytes at offset as a uint8 array.
+# The offset and length must be multiples of 8.
+def pattern_data(pattern, offset, length, seed = 0):
+    words = numpy.arange(
+        offset // 8, (offset + length) // 8, dtype = numpy.uint64)
+    return pattern(words, seed).view(numpy.uint8)
+
+
+# ------------------------------------------------------------------------------
+# Error accumulation
+
+# Errors seen so far: the number of errors on each DQ pin and the first few
+# mismatches as (address, expected, actual) byte values
+class FaultMap:
+    MAX_MISMATCHES = 16
+
+    def __init__(self):
+        self.pin_errors = numpy.zeros(DQ_PINS, dtype = numpy.int64)
+        self.mismatches = []
+        self.bytes_checked = 0
+
+    # Compares actual data read at offset with the expected data.  The offset
+    # must be a multiple of the 64 byte block size.
+    def check(self, offset, expected, actual):
+        self.bytes_checked += len(expected)
+        errors = expected ^ actual
+        bad = numpy.flatnonzero(errors)
+        if len(bad):
+            bits = numpy.unpackbits(
+                errors[bad, None], axis = 1, bitorder = 'little')
+            pins = PIN_MAP[bad % BLOCK_BYTES]
+            self.pin_errors += numpy.bincount(
+                pins[bits.astype(bool)], minlength = DQ_PINS)
+            for n in bad[:self.MAX_MISMATCHES - len(self.mismatches)]:
+                self.mismatches.append(
+                    (offset + int(n), int(expected[n]), int(actual[n])))
+
+    def merge(self, other):
+        self.pin_errors += other.pin_errors
+        self.bytes_checked += other.bytes_checked
+        self.mismatches = sorted(self.mismatches + other.mismatches)[
+            :self.MAX_MISMATCHES]
+
+    @property
+    def errors(self):
+        return int(self.pin_errors.sum())
+
+    def lane_errors(self):
+        return self.pin_errors.reshape(8, 8).sum(1)
+
+    def channel_errors(self):
+        return self.pin_errors.reshape(4, 16).sum(1)
+
+
+# Prints the error count on each pin, laid out as channels of two byte lanes,
+# followed by totals for each lane and channel
+def print_heatmap(faults):
+    # Scale counts to a single character: . for none, then 0 to 9 on a log
+    # scale relative to the worst pin
+    counts = faults.pin_errors
+    worst = max(int(counts.max()), 1)
+    levels = numpy.ceil(9 * numpy.log1p(counts) / numpy.log1p(worst))
+    cells = [
+        '.' if count == 0 else '%d' % level
+        for count, level in zip(counts, levels)]
+    print('Pin errors (log scale, . = none, 9 = %d)' % worst)
+    print('     01234567 01234567')
+    for channel in range(4):
+        lanes = [
+            ''.join(cells[8 * lane : 8 * lane + 8])
+            for lane in (2 * channel, 2 * channel + 1)]
+        print('CH%d  %s %s' % (channel, *lanes))
+    print('Lane errors:   ', ' '.join('%d' % n for n in faults.lane_errors()))
+    print('Channel errors:',
+        ' '.join('%d' % n for n in faults.channel_errors()))
+
+def print_mismatches(faults):
+    for address, expected, actual in faults.mismatches:
+        difference = expected ^ actual
+        pins = PIN_MAP[address % BLOCK_BYTES][
+            numpy.unpackbits(
+                numpy.uint8(difference), bitorder = 'little').astype(bool)]
+        print('%010X: expected %02X read %02X, pins %s' % (
+            address, expected, actual, ' '.join(map(str, pins))))
+
+
+# ------------------------------------------------------------------------------
+# Test engine
+
+class MemTest:
+    # Tests size bytes of the open device fd in blocks of block bytes, using
+    # the given number of parallel workers
+    def __init__(self, fd, size, block = 1 << 20, workers = 1):
+        assert block % BLOCK_BYTES == 0, \
+            'Block size must be a multiple of %d' % BLOCK_BYTES
+        assert size % block == 0, 'Size must be a multiple of block size'
+        self.fd = fd
+        self.size = size
+        self.block = block
+        self.workers = workers
+
+    def __write(self, pattern, seed, offset):
+        data = pattern_data(pattern, offset, self.block, seed)
+        os.pwrite(self.fd, data, offset)
+
+    def __verify(self, pattern, seed, offset, faults):
+        expected = pattern_data(pattern, offset, self.block, seed)
+        actual = numpy.frombuffer(
+            os.pread(self.fd, self.block, offset), dtype = numpy.uint8)
+        faults.check(offset, expected, actual)
+
+    # Runs action(offsets, faults) on each worker's share of the blocks, which
+    # are taken in ascending or descending order, and returns the merged
+    # faults
+    def __parallel(self, action, descending = False):
+        offsets = numpy.arange(0, self.size, self.block)
+        if descending:
+            offsets = offsets[::-1]
+        shares = numpy.array_split(offsets, self.workers)
+        faults = [FaultMap() for _ in shares]
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
+            for future in [
+                    executor.submit(action, share.tolist(), fault)
+                    for share, fault in zip(shares, faults)]:
+                future.result()
+        result = FaultMap()
+        for fault in faults:
+            result.merge(fault)
+        return result
+
+    # Writes the pattern to the whole device
+    def write(self, pattern, seed = 0):
+        def action(offsets, faults):
+            for offset in offsets:
+                self.__write(pattern, seed, offset)
+        self.__parallel(action)
+
+    # Checks the whole device against the pattern, returns a FaultMap
+    def verify(self, pattern, seed = 0):
+        def action(offsets, faults):
+            for offset in offsets:
+                self.__verify(pattern, seed, offset, faults)
+        return self.__parallel(action)
+
+    def test(self, pattern, seed = 0):
+        self.write(pattern, seed)
+        return self.verify(pattern, seed)
+
+    # Runs the March C- test, treating each block as a single cell:
+    #   up/down (w0); up (r0, w1); up (r1, w0);
+    #   down (r0, w1); down (r1, w0); up/down (r0)
+    # Each worker marches over its own share of the device.
+    def march(self):
+        elements = [
+            (False, None, _ZEROS),
+            (False, _ZEROS, _ONES),
+            (False, _ONES, _ZEROS),
+            (True, _ZEROS, _ONES),
+            (True, _ONES, _ZEROS),
+            (False, _ZEROS, None),
+        ]
+        result = FaultMap()
+        for descending, read, write in elements:
+            def action(offsets, faults):
+                for offset in offsets:
+                    if read:
+                        self.__verify(read, 0, offset, faults)
+                    if write:
+                        self.__write(write, 0, offset)
+            result.merge(self.__parallel(action, descending))
+        return result
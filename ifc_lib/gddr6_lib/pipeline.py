@@ -0,0 +1,91 @@
+# Complete SG RAM setup run in a single process
+#
+# Runs the same stages as the individual setup tools, but the registers are
+# only opened once and the exchange and delay state is shared between stages.
+
+import time
+from collections import namedtuple
+
+from .exchange import _Exchange
+from .delays import DelayBank
+from .train_ca import CATraining
+from .train_read import ReadTraining
+from .train_write import WriteTraining
+from . import setup
+from . import vendor
+from . import calibration
+
+
+# Result of a single setup stage: the time taken in seconds and the value
+# returned by the stage
+StageResult = namedtuple('StageResult', ['name', 'seconds', 'result'])
+
+# Result of complete setup
+SetupResult = namedtuple('SetupResult', [
+    'stages', 'seconds',
+    'ca_phase', 'vendor_id', 'read_windows', 'write_windows'])
+
+
+# Runs each stage in turn, timing each one.  A failing stage raises an
+# exception and the remaining stages are not run.
+class Stages:
+    def __init__(self, verbose):
+        self.verbose = verbose
+        self.stages = []
+
+    def run(self, name, action, *args, **kargs):
+        start = time.time()
+        result = action(*args, **kargs)
+        seconds = time.time() - start
+        self.stages.append(StageResult(name, seconds, result))
+        if self.verbose:
+            print('%-12s %6.3f s' % (name, seconds))
+        return result
+
+
+# Runs complete setup of SG RAM on the given SG register bank.  If
+# calibration_file is specified training starts from and updates the stored
+# calibration, and if report is specified the read and write training results
+# are written to this file.  Stage progress is only printed if quiet is less
+# than 2.  Stage results are recorded in stages if given, so that they are
+# available if setup fails.
+def setup_sgram(sg, calibration_file = None, report = None, verbose = False,
+        quiet = 1, stages = None):
+    start = time.time()
+    if stages is None:
+        stages = Stages(verbose)
+
+    stages.run('disable-ctrl', setup.disable_ctrl, sg)
+    stages.run('reset-ck', setup.reset_ck, sg)
+
+    exchange = _Exchange(sg)
+    try:
+        delay_bank = DelayBank(sg)
+
+        stages.run('reset-sg', setup.reset_sg, sg, exchange)
+        ca_phase = stages.run('train-ca', lambda:
+            CATraining(sg, exchange, quiet).train(
+                calibration_file, save = False))
+        vendor_id = stages.run('read-vid', vendor.read_vid, sg, exchange, quiet)
+        # The stored read and write calibrations are selected by temperature,
+        # which can only be read once CA training is complete, so the CA phase
+        # is saved here together with the temperature
+        temperature = float(vendor_id.temperatures.mean())
+        if calibration_file:
+            calibration.save_stage(
+                calibration_file, 'ca', temperature, phase = ca_phase)
+        stages.run('config-sg', setup.config_sg, sg, exchange)
+        read_windows = stages.run('train-read', lambda:
+            ReadTraining(sg, exchange, delay_bank, quiet).train(
+                calibration_file, report, temperature = temperature))
+        write_windows = stages.run('train-write', lambda:
+            WriteTraining(sg, exchange, delay_bank, quiet).train(
+                calibration_file, report, append = True,
+                temperature = temperature))
+        stages.run('enable-ctrl', setup.enable_ctrl, sg)
+    finally:
+        exchange.discard()
+
+    return SetupResult(
+        stages.stages, time.time() - start,
+        ca_phase, vendor_id, read_windows, write_windows)
@@ -0,0 +1,117 @@
+# Scheduling of CA commands into exchanges subject to timing rules
+#
+# Commands are issued in the order given, each at the earliest tick allowed by
+# the timing rules against all commands already placed in the same exchange.
+# The gap between exchanges is far longer than any rule, so every new exchange
+# starts at tick 0 with no constraints.
+
+import numpy
+
+from . import decode
+from .commands import NOP
+from .exchange import ExchangeProgram
+
+
+_ALL = list(range(len(decode.OPCODE_NAMES)))
+_READS = [decode.RD, decode.RDA]
+_WRITES = [
+    decode.WOM, decode.WOMA, decode.WSM, decode.WSMA, decode.WDM, decode.WDMA]
+_PRECHARGES = [decode.PREpb, decode.PREab]
+_REFRESHES = [decode.REFp2b, decode.REFab]
+
+# Each rule gives a list of first commands, a list of following commands, and
+# the minimum number of CK ticks from first to following command.  Values are
+# for CK at 250 MHz.
+TIMING_RULES = [
+    # tMRD: MRS to any command
+    ([decode.MRS], _ALL, 10),
+    # tLTLTR: LDFF to LDFF or RDTR
+    ([decode.LDFF], [decode.LDFF, decode.RDTR], 4),
+    # Training bursts occupy two ticks
+    ([decode.RDTR, decode.WRTR], [decode.RDTR, decode.WRTR], 2),
+    # tRCD: ACT to read or write
+    ([decode.ACT], _READS + _WRITES, 5),
+    # tRAS: ACT to precharge
+    ([decode.ACT], _PRECHARGES, 7),
+    # tRP: precharge to ACT or refresh
+    (_PRECHARGES, [decode.ACT] + _REFRESHES, 5),
+    # tRFC: refresh to ACT or refresh
+    (_REFRESHES, [decode.ACT] + _REFRESHES, 65),
+]
+
+
+# Converts a list of rules into a table of minimum spacing indexed by pairs of
+# opcodes.  Commands with no rule between them can go on consecutive ticks.
+def spacing_table(rules):
+    count = len(decode.OPCODE_NAMES)
+    table = numpy.ones((count, count), dtype = int)
+    for first, following, ticks in rules:
+        index = numpy.ix_(first, following)
+        table[index] = numpy.maximum(table[index], ticks)
+    return table
+
+
+# Each scheduler is used once: commands are added, then finish() or run() is
+# called once to produce or send the exchanges.
+class Scheduler:
+    def __init__(self, rules = TIMING_RULES,
+            max_ticks = ExchangeProgram.MAX_COMMANDS):
+        self.spacing = spacing_table(rules)
+        self.max_ticks = max_ticks
+        self.programs = []
+        self.command_count = 0
+        self.finished = False
+        self.__commands = []
+        self.__issued = []
+
+    # Adds a command at the earliest permitted tick, starting a new exchange
+    # if it will not fit in the current one
+    def command(self, command):
+        assert not self.finished, 'Scheduler already finished'
+        opcode = decode.decode_ca([command[0]], [command[1]])['opcode'][0]
+        tick = max(
+            (t + self.spacing[o, opcode] for t, o in self.__issued),
+            default = 0)
+        # Leave room for the final NOP
+        if tick > self.max_ticks - 2:
+            self.__flush()
+            tick = 0
+        self.__commands.extend((tick - len(self.__commands)) * [NOP])
+        self.__commands.append(command)
+        self.__issued.append((tick, opcode))
+        self.command_count += 1
+
+    def commands(self, commands):
+        for command in commands:
+            self.command(command)
+
+    # Each exchange ends with a NOP so that the CA bus is left idle
+    def __flush(self):
+        if self.__commands:
+            program = ExchangeProgram()
+            for command in self.__commands:
+                program.command(command)
+            program.command(NOP)
+            self.programs.append(program.compile())
+        self.__commands = []
+        self.__issued = []
+
+    # Returns the list of programs needed to send all scheduled commands
+    def finish(self):
+        assert not self.finished, 'Scheduler already finished'
+        self.__flush()
+        self.finished = True
+        return self.programs
+
+    # Sends all scheduled commands
+    def run(self, exchange):
+        for program in self.finish():
+            exchange.load(program)
+            exchange.exchange()
+
+    def ticks(self):
+        return sum(len(program) for program in self.programs)
+
+    def report(self):
+        return '{:d} commands in {:d} exchanges, {:d} ticks'.format(
+            self.command_count, len(self.programs), self.ticks())
@@ -0,0 +1,215 @@
+# Search for data eyes across a range of delays
+#
+# All searches are driven by a test function which is passed an array of
+# delays, one per pin, sets them, runs a single exchange, and returns an array
+# of booleans marking which pins saw correct data.  All strategies return the
+# same (centres, lengths) result: for each pin the length of the longest eye
+# and the delay at its centre, or (0, 0) if no eye was found on that pin.
+#
+# The linear sweep tests every delay.  The other strategies start with a
+# coarse sweep at intervals of stride and then refine the rising and falling
+# edge of each candidate eye, either by stepping in from the passing side or by
+# bisection, while checking that no failing gap is hidden inside the eye.  All
+# pins are refined in parallel, and pins whose result is already resolved are
+# left unchanged.  Eyes narrower than the stride can be missed, as can gaps
+# narrower than verify, in which case the result can differ from the sweep.
+
+import time
+import bisect
+import numpy
+
+from . import eyes as eyes_lib
+
+
+STRATEGIES = ['sweep', 'step', 'bisect']
+
+
+# Tests every delay from 0 to max_delay-1 and returns an array of matches
+# indexed by delay and pin
+def sweep_delays(test, pins, max_delay):
+    matches = numpy.zeros((max_delay, pins), dtype = numpy.bool_)
+    for delay in range(max_delay):
+        matches[delay] = test(numpy.full(pins, delay))
+    return matches
+
+
+# A candidate eye during refinement.  passes is a sorted list of delays known
+# to pass, before and after are the nearest delays either side known to fail,
+# or the limits of the delay range.  The eye is assumed to be solid between
+# passes no more than verify apart, and wider gaps are probed in case they hide
+# a failing region.  The eye is resolved when both edges are found and no such
+# gaps remain.
+class _Eye:
+    def __init__(self, before, passes, after):
+        self.before = before
+        self.passes = passes
+        self.after = after
+
+    # Returns the index of the widest gap between passes if it needs checking
+    def __gap(self, verify):
+        gaps = numpy.diff(self.passes)
+        if len(gaps) > 0 and gaps.max() > verify:
+            return int(numpy.argmax(gaps))
+
+    def __edges(self):
+        return (self.passes[0] - self.before, self.after - self.passes[-1])
+
+    def resolved(self, verify):
+        return self.__edges() == (1, 1) and self.__gap(verify) is None
+
+    # Returns (low, high) bounds on the length of the eye.  Until all gaps are
+    # checked the eye may yet split, so the low bound is only usable after that
+    def bounds(self, verify):
+        high = self.after - self.before - 1
+        if self.__gap(verify) is None:
+            return (self.passes[-1] + 1 - self.passes[0], high)
+        else:
+            return (0, high)
+
+    # Returns the next delay to test, gaps are bisected before edges are refined
+    def probe(self, verify, halve):
+        gap = self.__gap(verify)
+        if gap is not None:
+            return (self.passes[gap] + self.passes[gap + 1]) // 2
+        rising, falling = self.__edges()
+        if rising >= falling:
+            if halve:
+                return (self.before + self.passes[0]) // 2
+            else:
+                return self.passes[0] - 1
+        else:
+            if halve:
+                return (self.passes[-1] + self.after) // 2
+            else:
+                return self.passes[-1] + 1
+
+    # Updates the eye with a test result and returns the resulting list of eyes:
+    # a failure between passes splits the eye in two
+    def update(self, delay, ok):
+        index = bisect.bisect(self.passes, delay)
+        if ok:
+            self.passes.insert(index, delay)
+        elif index == 0:
+            self.before = delay
+        elif index == len(self.passes):
+            self.after = delay
+        else:
+            return [
+                _Eye(self.before, self.passes[:index], delay),
+                _Eye(delay, self.passes[index:], self.after)]
+        return [self]
+
+
+# Returns the eyes which can still be selected as the longest eye.  Eyes are in
+# order of delay, and the first of a set of equal length eyes is preferred.
+def _candidate_eyes(eyes, verify):
+    bounds = [eye.bounds(verify) for eye in eyes]
+    def beaten(j):
+        low_j, high_j = bounds[j]
+        return any(
+            high_j <= low_i if i < j else high_j < low_i
+            for i, (low_i, _) in enumerate(bounds) if i != j)
+    return [eye for j, eye in enumerate(eyes) if not beaten(j)]
+
+# Returns the candidate eye to refine next, or None if all are resolved.  The
+# eye which could be longest is refined first.
+def _next_eye(eyes, verify):
+    best = None
+    for eye in _candidate_eyes(eyes, verify):
+        if not eye.resolved(verify):
+            if best is None or eye.bounds(verify)[1] > best.bounds(verify)[1]:
+                best = eye
+    return best
+
+
+# Finds candidate eyes from a coarse sweep with the given stride
+def _coarse_eyes(test, pins, max_delay, stride):
+    delays = numpy.arange(0, max_delay, stride)
+    matches = numpy.array([test(numpy.full(pins, delay)) for delay in delays])
+    # Sentinel delays either side of the swept range
+    bounds = numpy.concatenate(([-1], delays, [max_delay])).tolist()
+    eyes = [[] for _ in range(pins)]
+    for pin, start, end in zip(*eyes_lib.find_runs(matches)):
+        eyes[pin].append(_Eye(
+            bounds[start], bounds[start + 1 : end + 1], bounds[end + 1]))
+    return (eyes, delays[-1])
+
+def _refine_eyes(test, eyes, delay, verify, halve):
+    delays = numpy.full(len(eyes), delay)
+    while True:
+        probes = []
+        for pin, pin_eyes in enumerate(eyes):
+            eye = _next_eye(pin_eyes, verify)
+            if eye is not None:
+                delays[pin] = eye.probe(verify, halve)
+                probes.append((pin, eye))
+        if not probes:
+            break
+        # Pins with nothing to probe keep their previous delay
+        ok = test(delays)
+        for pin, eye in probes:
+            index = eyes[pin].index(eye)
+            eyes[pin][index : index + 1] = \
+                eye.update(int(delays[pin]), ok[pin])
+
+# If intervals is passed as a list it is filled with a list of (length, centre)
+# for each eye found on each pin.  For the coarse strategies eyes which cannot
+# be the longest are not refined, so their lengths are lower bounds.
+def search_eyes(test, pins, max_delay,
+        strategy = 'bisect', stride = 32, verify = 8, intervals = None):
+    assert strategy in STRATEGIES, 'Unknown search strategy %s' % strategy
+    if strategy == 'sweep':
+        matches = sweep_delays(test, pins, max_delay)
+        if intervals is not None:
+            intervals[:] = [[] for _ in range(pins)]
+            for pin, start, end in zip(*eyes_lib.find_runs(matches)):
+                intervals[pin].append(
+                    (int(end - start), int(start + end) // 2))
+        return eyes_lib.find_eyes(matches)
+
+    eyes, delay = _coarse_eyes(test, pins, max_delay, stride)
+    _refine_eyes(test, eyes, delay, verify, strategy == 'bisect')
+    if intervals is not None:
+        intervals[:] = [
+            [(eye.passes[-1] + 1 - eye.passes[0],
+              (eye.passes[0] + eye.passes[-1] + 1) // 2)
+             for eye in pin_eyes]
+            for pin_eyes in eyes]
+
+    centres = numpy.zeros(pins, dtype = int)
+    lengths = numpy.zeros(pins, dtype = int)
+    for pin, pin_eyes in enumerate(eyes):
+        candidates = _candidate_eyes(pin_eyes, verify)
+        if candidates:
+            start = candidates[0].passes[0]
+            end = candidates[0].after
+            centres[pin] = (start + end) // 2
+            lengths[pin] = end - start
+    return (centres, lengths)
+
+
+# Runs every strategy and returns a list of tuples (strategy, exchanges,
+# seconds, centres, lengths)
+def benchmark(test, pins, max_delay, stride = 32, verify = 8):
+    results = []
+    for strategy in STRATEGIES:
+        exchanges = 0
+        def counting_test(delays):
+            nonlocal exchanges
+            exchanges += 1
+            return test(delays)
+        start = time.time()
+        centres, lengths = search_eyes(
+            counting_test, pins, max_delay, strategy, stride, verify)
+        results.append(
+            (strategy, exchanges, time.time() - start, centres, lengths))
+    return results
+
+# Prints the result of benchmark, comparing each strategy against the first
+def print_benchmark(results):
+    _, _, _, centres, lengths = results[0]
+    for strategy, exchanges, seconds, c, l in results:
+        same = (c == centres).all() and (l == lengths).all()
+        print('%-8s %4d exchanges %7.3f s  %s' % (
+            strategy, exchanges, seconds,
+            'same' if same else 'differs from %s' % results[0][0]))
@@ -1,5 +1,16 @@
 # Helpers for managing common configuration
 
+import time
+
+from .commands import (
+    NOP, RESET_SG1_CA, RESET_SG2_CA,
+    INIT_MR0, INIT_MR1, INIT_MR2, INIT_MR3, INIT_MR4, INIT_MR5,
+    INIT_MR6_B0_VREF, INIT_MR6_B1_VREF, INIT_MR6_B0_TXEQ, INIT_MR6_B1_TXEQ,
+    INIT_MR7, INIT_MR8, INIT_MR9_B0_DEF, INIT_MR9_B1_DEF,
+    INIT_MR10, INIT_MR10_WCK2CK, INIT_MR12)
+from .schedule import Scheduler
+
+
 def check_ck_ready(sg):
     assert sg.CONFIG._value != 0xFFFFFFFF, 'Probably need to rescan PCIe bus'
     assert sg.CONFIG.CK_RESET_N, 'CK is in reset'
@@ -44,3 +55,77 @@ def reset_training_control(sg):
         DBI_TRAINING = 0,
         CAPTURE_EDC_OUT = 0,
         EDC_SELECT = 0)
+
+
+# Resets CK and the entire PHY.  The controller is disabled and SG is put into
+# reset first, as once CK is in reset communication with SG stops.
+def reset_ck(sg):
+    assert sg.CONFIG._value != 0xFFFFFFFF, 'Probably need to rescan PCIe bus'
+    sg.CONFIG._write_fields_rw(
+        # Put memory into reset
+        SG_RESET_N = 0,
+        # Can't have controller in charge!
+        ENABLE_CONTROL = 0,
+        ENABLE_REFRESH = 0,
+        ENABLE_AXI = 0)
+
+    sg.CONFIG._write_fields_rw(CK_RESET_N = 0)
+    time.sleep(0.1)
+
+    # Take CK out of reset
+    sg.CONFIG.CK_RESET_N = 1
+    time.sleep(0.1)
+    assert sg.STATUS.CK_OK, 'CK is not running and enabled'
+
+
+# Brings SG out of reset
+def reset_sg(sg, exchange):
+    check_ck_ready(sg)
+    disable_ctrl(sg)
+
+    sg.CONFIG.SG_RESET_N = 0
+    time.sleep(0.1)
+
+    # During reset need to ensure data is sent as requested
+    sg.CONFIG.ENABLE_CABI = 0
+    # Perform reset with EDC driven high
+    sg.CONFIG.EDC_T = 0
+
+    time.sleep(0.01)
+    exchange.set_ca(RESET_SG1_CA, 1)
+    sg.CONFIG.SG_RESET_N = 1
+
+    time.sleep(0.01)
+    exchange.set_ca(RESET_SG2_CA, 1)
+    sg.CONFIG.SG_RESET_N = 3
+
+    # Now allow EDC_T to be driven by SG RAM
+    sg.CONFIG.EDC_T = 1
+
+    # Complete initialisation by sending NOP and pulling CKEn low
+    time.sleep(0.01)
+    exchange.set_ca(NOP, 0)
+
+
+# Initialises all the MR registers after SG reset and performs WCK training.
+# Returns the scheduler used to send the commands.
+def config_sg(sg, exchange):
+    check_sg_ready(sg)
+
+    scheduler = Scheduler()
+    scheduler.commands([
+        INIT_MR0, INIT_MR1, INIT_MR2, INIT_MR3, INIT_MR4, INIT_MR5,
+        INIT_MR6_B0_VREF, INIT_MR6_B1_VREF,
+        INIT_MR6_B0_TXEQ, INIT_MR6_B1_TXEQ,
+        INIT_MR7, INIT_MR8, INIT_MR9_B0_DEF, INIT_MR9_B1_DEF,
+        INIT_MR10, INIT_MR12])
+    # Finally perform WCK training, this can share the last exchange
+    scheduler.command(INIT_MR10_WCK2CK)
+    scheduler.run(exchange)
+
+    # The delay between exchanges should be enough to complete this
+    exchange.reset()
+    exchange.command(INIT_MR10)
+    exchange.command(NOP)
+    exchange.exchange()
+    return scheduler
@@ -0,0 +1,648 @@
+# Software model of the GDDR6 PHY and SGRAM
+#
+# This provides a simulated set of GDDR6 registers which can be used in place of
+# the hardware registers returned by bind_ifc_1412.open() so that the setup and
+# training tools can be run and timed without hardware.  The CONFIG, STATUS,
+# TEMPS, DELAY and EXCHANGE registers defined in gddr6_register_defines.in are
+# implemented, and behind the EXCHANGE registers sits a behavioural model of the
+# SGRAM which responds to the commands used for setup and training.
+#
+# Data timing is modelled in bits (8 per CK tick) and IDELAY/ODELAY taps.  Each
+# IO pin has a fixed skew and eye width and each CA line has a window of good
+# CK phases.  These parameters are generated from a seed so that a simulation
+# is repeatable.
+#
+# Things not modelled: DBI and CABI inversion, EDC CRC output, the memory
+# controller and AXI interface, and the contents of most mode registers.
+
+import collections
+import functools
+import os
+import pickle
+import numpy
+
+from ifc_lib import defs_path
+from . import decode
+
+
+# Latencies in CK ticks, chosen to match the row offsets used by the training
+# tools.  The capture delays are from SG output to data appearing in the
+# exchange capture buffer, all other latencies are from CA command to SG input
+# or output.
+CAPTURE_DELAY = 13          # SG output to captured DQ and DBI
+EDC_CAPTURE_DELAY = 14      # SG output to captured EDC
+WRITE_LATENCY = 3           # WRTR to write data
+READ_LATENCY = 8            # RDTR to read data
+CAT_DQ_LATENCY = 3          # CA to CAT result on DQ and DBI
+CAT_EDC_LATENCY = 1         # CA to CAT result on EDC
+MODE_LATENCY = 2            # MRS to change of output mode
+
+# Pin counts, DQ pins are followed by DBI and then EDC
+DQ_PINS = 64
+OUTPUT_PINS = 72
+INPUT_PINS = 80
+
+# Bit of the 10 bit LDFF and CA training values seen by each pin
+LANE_BIT = numpy.concatenate((
+    numpy.arange(DQ_PINS) % 8, numpy.full(8, 8), numpy.full(8, 9)))
+
+# Targets for DELAY register, as for delays.py
+TARGET_IDELAY = 0
+TARGET_ODELAY = 1
+TARGET_IBITSLIP = 2
+TARGET_OBITSLIP = 3
+
+MAX_DELAY = 511
+PHASE_STEPS = 224
+
+# Values returned by MR3 vendor modes
+VENDOR_ID1 = 0xEB1F
+VENDOR_ID2 = 0xFFFC
+
+NOP = (0x3FF, 0x3FF)
+
+
+# Reads the register definitions.  Groups are flattened, and the result is a
+# dictionary mapping register name to a tuple of register type and a dictionary
+# of fields, each field giving (offset, width).
+@functools.lru_cache()
+def register_defines(filename = None):
+    if filename is None:
+        filename = defs_path.module_defines('gddr6')
+    registers = {}
+    for line in open(filename):
+        words = line.split('#', 1)[0].split()
+        if not words or words[0].startswith('!'):
+            pass
+        elif words[0].startswith('.'):
+            width = int(words[1]) if len(words) > 1 else 1
+            offset = sum(w for _, w in fields.values())
+            fields[words[0][1:]] = (offset, width)
+        else:
+            fields = {}
+            registers[words[0]] = (words[1], fields)
+    return registers
+
+
+def pack_fields(register, **values):
+    _, fields = register_defines()[register]
+    result = 0
+    for name, value in values.items():
+        offset, width = fields[name]
+        value = int(value)
+        assert 0 <= value < (1 << width), \
+            'Value %d out of range for %s.%s' % (value, register, name)
+        result |= value << offset
+    return result
+
+def unpack_fields(register, value):
+    _, fields = register_defines()[register]
+    return {
+        name: (value >> offset) & ((1 << width) - 1)
+        for name, (offset, width) in fields.items()}
+
+
+# Samples a set of bit streams, one row per pin, at count bit slots starting at
+# bit start of the stream.  The lateness of each pin is given in taps.  Samples
+# which fall outside the eye return the bit on the far side of the nearest
+# edge, which is deterministic and is only wrong if the data changes at that
+# edge.  Bits outside the stream are idle and read as 1.
+def sample_bits(streams, lateness, eye, taps_per_bit, start, count):
+    slots = numpy.arange(start, start + count)
+    position = (slots + 0.5) * taps_per_bit - lateness[:, None]
+    index = numpy.floor(position / taps_per_bit).astype(int)
+    offset = position - (index + 0.5) * taps_per_bit
+    outside = 2 * numpy.abs(offset) > eye[:, None]
+    index += outside * numpy.sign(offset).astype(int)
+
+    length = streams.shape[1]
+    valid = (0 <= index) & (index < length)
+    pins = numpy.arange(streams.shape[0])[:, None]
+    samples = streams[pins, numpy.clip(index, 0, length - 1)]
+    return numpy.where(valid, samples, 1).astype(numpy.uint8)
+
+
+# Fixed properties of the simulated hardware.  Skews are in taps and give how
+# early data arrives, eye widths are in taps, and each CA line has a window of
+# good CK phases given as a signed (low, high) range.
+class Parameters:
+    def __init__(self, seed = 0):
+        rng = numpy.random.default_rng(seed)
+        self.seed = seed
+        self.taps_per_bit = 100
+        self.input_skew = rng.integers(100, 350, INPUT_PINS)
+        self.input_eye = rng.integers(55, 80, INPUT_PINS)
+        self.output_skew = rng.integers(100, 350, OUTPUT_PINS)
+        self.output_eye = rng.integers(55, 80, OUTPUT_PINS)
+        centres = rng.integers(-62, -46, 10)
+        widths = rng.integers(44, 60, 10)
+        self.ca_windows = numpy.stack(
+            (centres - widths // 2, centres + widths // 2), axis = 1)
+        # Temperatures of the four channels in degrees
+        self.temperatures = 2 * rng.integers(40, 48, 4) - 40
+
+
+# Behavioural model of the pair of SGRAM devices.  All four channels are
+# treated as a single device receiving the same commands.
+class Sgram:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.mode_registers = {}
+        self.cat_mode = 0
+        self.vendor_mode = 0
+        # Read FIFO, 6 entries of 16 bursts for all pins
+        self.fifo = numpy.ones((6, 16, INPUT_PINS), dtype = numpy.uint8)
+        self.write_pointer = 0
+        self.read_pointer = 0
+        # Outputs held in CA training mode, None when not driving
+        self.cat_dq = None
+        self.cat_edc = None
+        # Output events still to happen
+        self.events = []
+
+    def __vendor_value(self, temperatures):
+        if self.vendor_mode == 1:
+            values = 4 * [VENDOR_ID1]
+        elif self.vendor_mode == 2:
+            codes = (temperatures + 40) // 2
+            values = [code | (code << 8) for code in codes]
+        else:
+            values = 4 * [VENDOR_ID2]
+        bits = numpy.arange(DQ_PINS) % 16
+        return (numpy.repeat(values, 16) >> bits) & 1
+
+    def __schedule(self, tick, action, value = None):
+        self.events.append((tick, action, value))
+
+    def __apply(self, action, value):
+        if action == 'vendor':
+            self.vendor_mode = value
+        elif action == 'cat':
+            if not value:
+                self.cat_dq = None
+                self.cat_edc = None
+        elif action == 'cat_dq':
+            self.cat_dq = value
+        elif action == 'cat_edc':
+            self.cat_edc = value
+
+    def __mode_register(self, tick, mr, op):
+        self.mode_registers[mr] = op
+        if mr == 3:
+            self.__schedule(tick + MODE_LATENCY, 'vendor', (op >> 6) & 3)
+        elif mr == 15:
+            self.cat_mode = (op >> 2) & 3
+            self.__schedule(tick + MODE_LATENCY, 'cat', self.cat_mode)
+
+    # Only the commands used by setup and training have any effect
+    def __command(self, tick, command, sample_write):
+        opcode = command['opcode']
+        if opcode == decode.MRS:
+            self.__mode_register(tick, command['mr'], command['operand'])
+        elif opcode == decode.LDFF:
+            burst = command['address']
+            data = int(command['operand'])
+            self.fifo[self.write_pointer, burst] = (data >> LANE_BIT) & 1
+            if burst == 15:
+                self.write_pointer = (self.write_pointer + 1) % 6
+        elif opcode == decode.RDTR:
+            self.__schedule(tick + READ_LATENCY, 'read',
+                self.fifo[self.read_pointer].copy())
+            self.read_pointer = (self.read_pointer + 1) % 6
+        elif opcode == decode.WRTR:
+            entry = self.fifo[self.write_pointer]
+            entry[:, :OUTPUT_PINS] = sample_write(tick + WRITE_LATENCY).T
+            entry[:, OUTPUT_PINS:] = 1
+            self.write_pointer = (self.write_pointer + 1) % 6
+
+    # In CA training mode the CA bus is captured rather than decoded: only a
+    # CAT command held over both edges is recognised.  The captured value is
+    # output on ticks with CKE_N high and held until the next capture.
+    def __training(self, tick, ca0, ca1, cke_n, command):
+        if ca0 == ca1 and command['opcode'] == decode.MRS and \
+                command['mr'] == 15:
+            self.__mode_register(tick, command['mr'], command['operand'])
+        elif cke_n:
+            value = ca1 if self.cat_mode == 2 else ca0
+            bits = (value >> LANE_BIT) & 1
+            self.__schedule(tick + CAT_DQ_LATENCY, 'cat_dq', bits[:OUTPUT_PINS])
+            self.__schedule(
+                tick + CAT_EDC_LATENCY, 'cat_edc', bits[OUTPUT_PINS:])
+
+    # Runs the given sampled commands and returns the SG output bits over the
+    # requested number of ticks for all pins.  sample_write(tick) must return
+    # the host output for 16 bits starting at the given tick.  Commands are
+    # only accepted with CKE_N low.
+    def run(self, commands, ticks, temperatures, sample_write):
+        ca0, ca1, cke_n = zip(*commands)
+        decoded = decode.decode_ca(ca0, ca1)
+        for tick, command in enumerate(decoded):
+            if self.cat_mode:
+                self.__training(
+                    tick, ca0[tick], ca1[tick], cke_n[tick], command)
+            elif not cke_n[tick]:
+                self.__command(tick, command, sample_write)
+
+        output = numpy.ones((INPUT_PINS, 8 * ticks), dtype = numpy.uint8)
+        self.events.sort(key = lambda event: event[0])
+        events = collections.deque(self.events)
+        for tick in range(ticks):
+            while events and events[0][0] <= tick:
+                _, action, value = events.popleft()
+                if action == 'read':
+                    end = min(8 * ticks, 8 * tick + 16)
+                    output[:, 8 * tick:end] = value.T[:, :end - 8 * tick]
+                else:
+                    self.__apply(action, value)
+
+            ticks_slice = numpy.s_[8 * tick:8 * (tick + 1)]
+            if self.vendor_mode:
+                output[:DQ_PINS, ticks_slice] = \
+                    self.__vendor_value(temperatures)[:, None]
+            if self.cat_dq is not None:
+                output[:OUTPUT_PINS, ticks_slice] = self.cat_dq[:, None]
+            if self.cat_edc is not None:
+                output[OUTPUT_PINS:, ticks_slice] = self.cat_edc[:, None]
+
+        # Any events past the end of this exchange update the state seen by
+        # the next exchange, but read bursts are lost
+        for _, action, value in events:
+            if action != 'read':
+                self.__apply(action, value)
+        self.events = []
+        return output
+
+
+# Model of the PHY and the register interface.  Register reads and writes are
+# counted, and the complete state can be saved and restored so that a sequence
+# of tools can share a single simulated card.
+class Simulation:
+    def __init__(self, seed = 0):
+        self.params = Parameters(seed)
+        self.sgram = Sgram()
+        self.config = 0
+        self.reset_phy()
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.reads = collections.Counter()
+        self.writes = collections.Counter()
+        self.exchanges = 0
+
+    def reset_phy(self):
+        self.phase = 0
+        self.idelay = numpy.zeros(INPUT_PINS, dtype = int)
+        self.ibitslip = numpy.zeros(INPUT_PINS, dtype = int)
+        self.odelay = numpy.zeros(OUTPUT_PINS, dtype = int)
+        self.obitslip = numpy.zeros(OUTPUT_PINS, dtype = int)
+        self.delay_address = 0
+        self.delay_target = 0
+        self.last_ca = NOP
+
+        self.ca = numpy.zeros(64, dtype = numpy.uint32)
+        self.dq = numpy.zeros((64, 16), dtype = numpy.uint32)
+        self.dbi = numpy.zeros((64, 2), dtype = numpy.uint32)
+        self.ca_count = 0
+        self.dq_index = 0
+        self.dbi_index = 0
+
+        self.captured_dq = numpy.zeros((0, 16), dtype = numpy.uint32)
+        self.captured_dbi = numpy.zeros((0, 2), dtype = numpy.uint32)
+        self.captured_edc = numpy.zeros((0, 2), dtype = numpy.uint32)
+        self.start_read()
+
+
+    @classmethod
+    def load(cls, filename, seed = 0):
+        if os.path.exists(filename):
+            with open(filename, 'rb') as file:
+                return pickle.load(file)
+        else:
+            return cls(seed)
+
+    def save(self, filename):
+        with open(filename, 'wb') as file:
+            pickle.dump(self, file)
+
+    def registers(self):
+        return SimRegisters(self)
+
+
+    # Register access
+
+    def read(self, name):
+        self.reads[name] += 1
+        return int(getattr(self, '_read_' + name)())
+
+    def write(self, name, value):
+        self.writes[name] += 1
+        kind, _ = register_defines()[name]
+        assert kind != 'R', 'Register %s is read only' % name
+        getattr(self, '_write_' + name)(int(value))
+
+    def __config(self, field):
+        return unpack_fields('CONFIG', self.config)[field]
+
+    def _read_CONFIG(self):
+        return self.config
+
+    def _write_CONFIG(self, value):
+        old = unpack_fields('CONFIG', self.config)
+        new = unpack_fields('CONFIG', value)
+        self.config = value
+        if not new['CK_RESET_N']:
+            self.reset_phy()
+        if old['SG_RESET_N'] == 3 and new['SG_RESET_N'] != 3:
+            self.sgram.reset()
+
+    def _read_STATUS(self):
+        ck_ok = self.__config('CK_RESET_N')
+        return pack_fields('STATUS', CK_OK = ck_ok, FIFO_OK = 3 * ck_ok)
+
+    def _read_TEMPS(self):
+        if self.__config('ENABLE_CONTROL'):
+            codes = (self.params.temperatures + 40) // 2
+        else:
+            codes = [0, 0, 0, 0]
+        return pack_fields('TEMPS',
+            CH0 = codes[0], CH1 = codes[1], CH2 = codes[2], CH3 = codes[3])
+
+
+    def __delays(self, target):
+        return {
+            TARGET_IDELAY: self.idelay,
+            TARGET_ODELAY: self.odelay,
+            TARGET_IBITSLIP: self.ibitslip,
+            TARGET_OBITSLIP: self.obitslip,
+        }[target]
+
+    def _read_DELAY(self):
+        delays = self.__delays(self.delay_target)
+        if self.delay_address < len(delays):
+            delay = delays[self.delay_address]
+        else:
+            delay = 0
+        return pack_fields('DELAY',
+            ADDRESS = self.delay_address, TARGET = self.delay_target,
+            DELAY = delay, PHASE = self.phase)
+
+    def _write_DELAY(self, value):
+        fields = unpack_fields('DELAY', value)
+        self.delay_address = fields['ADDRESS']
+        self.delay_target = fields['TARGET']
+        if fields['STEP_PHASE']:
+            step = 1 if fields['UP_DOWN_N'] else -1
+            self.phase = (self.phase + step) % PHASE_STEPS
+
+        delays = self.__delays(self.delay_target)
+        if fields['ENABLE_WRITE'] and self.delay_address < len(delays):
+            if self.delay_target in [TARGET_IBITSLIP, TARGET_OBITSLIP]:
+                delays[self.delay_address] = fields['DELAY'] & 7
+            else:
+                step = fields['DELAY'] + 1
+                if not fields['UP_DOWN_N']:
+                    step = - step
+                delays[self.delay_address] = numpy.clip(
+                    delays[self.delay_address] + step, 0, MAX_DELAY)
+
+
+    def _read_COMMAND(self):
+        return 0
+
+    def _write_COMMAND(self, value):
+        fields = unpack_fields('COMMAND', value)
+        if fields['START_WRITE']:
+            self.ca_count = 0
+            self.dq_index = 0
+            self.dbi_index = 0
+        if fields['EXCHANGE']:
+            self.exchange()
+        if fields['START_READ']:
+            self.start_read()
+        if fields['STEP_READ']:
+            self.read_row += 1
+            self.read_index = {'DQ': 0, 'DBI': 0, 'EDC': 0}
+
+    def _read_CA(self):
+        return self.ca[max(self.ca_count - 1, 0)]
+
+    def _write_CA(self, value):
+        if self.ca_count < 64:
+            self.ca[self.ca_count] = value
+            self.ca_count += 1
+        self.dq_index = 0
+        self.dbi_index = 0
+
+    def _write_DQ(self, value):
+        if self.ca_count < 64:
+            self.dq[self.ca_count, self.dq_index % 16] = value
+        self.dq_index += 1
+
+    def _write_DBI(self, value):
+        if self.ca_count < 64:
+            self.dbi[self.ca_count, self.dbi_index % 2] = value
+        self.dbi_index += 1
+
+    def start_read(self):
+        self.read_row = 0
+        self.read_index = {'DQ': 0, 'DBI': 0, 'EDC': 0}
+
+    def __read_captured(self, name, captured):
+        index = self.read_index[name]
+        self.read_index[name] += 1
+        if self.read_row < len(captured):
+            return captured[self.read_row, index % captured.shape[1]]
+        else:
+            return 0
+
+    def _read_DQ(self):
+        return self.__read_captured('DQ', self.captured_dq)
+
+    def _read_DBI(self):
+        if self.__config('CAPTURE_EDC_OUT'):
+            # The EDC CRC output is not modelled
+            self.read_index['DBI'] += 1
+            return 0
+        else:
+            return self.__read_captured('DBI', self.captured_dbi)
+
+    def _read_EDC(self):
+        return self.__read_captured('EDC', self.captured_edc)
+
+
+    # Exchange
+
+    # Applies the CA phase to the commands in the exchange.  Outside its phase
+    # window each CA line is sampled half a tick away, and so picks up the value
+    # from the neighbouring edge.
+    def __sample_commands(self, rising, falling, cke_n):
+        phase = self.phase
+        if phase >= PHASE_STEPS // 2:
+            phase -= PHASE_STEPS
+        low, high = self.params.ca_windows.T
+        bits = 1 << numpy.arange(10)
+        early = int(bits[phase > high].sum())
+        late = int(bits[phase < low].sum())
+        good = 0x3FF & ~(early | late)
+
+        previous = [self.last_ca[1]] + falling[:-1]
+        following = rising[1:] + rising[-1:]
+        return [
+            ((r & good) | (p & early) | (f & late),
+             (f & good) | (r & early) | (n & late), c)
+            for r, f, p, n, c in
+                zip(rising, falling, previous, following, cke_n)]
+
+    def __input_lateness(self):
+        return self.idelay + self.ibitslip * self.params.taps_per_bit - \
+            self.params.input_skew
+
+    def __output_lateness(self):
+        return self.odelay + self.obitslip * self.params.taps_per_bit - \
+            self.params.output_skew
+
+    def exchange(self):
+        count = self.ca_count
+        self.exchanges += 1
+        if count == 0 or not self.__config('CK_RESET_N'):
+            return
+
+        ca = [int(ca) for ca in self.ca[:count]]
+        rising = [ca & 0x3FF for ca in ca]
+        falling = [(ca >> 10) & 0x3FF for ca in ca]
+        cke_n = [(ca >> 24) & 1 for ca in ca]
+        oe = numpy.array([(ca >> 25) & 1 for ca in ca], dtype = bool)
+
+        # Host output, DBI only carries data when training
+        if self.__config('DBI_TRAINING'):
+            dbi = self.dbi[:count]
+        else:
+            dbi = numpy.full((count, 2), 0xFFFFFFFF, dtype = numpy.uint32)
+        words = numpy.concatenate((self.dq[:count], dbi), axis = 1)
+        bits = numpy.unpackbits(
+            words.view(numpy.uint8).T, axis = 1, bitorder = 'little')
+        host_oe = numpy.repeat(oe, 8)
+        host = numpy.where(host_oe, bits, 1).astype(numpy.uint8)
+
+        params = self.params
+        taps = params.taps_per_bit
+        input_lateness = self.__input_lateness()
+        output_lateness = self.__output_lateness()
+
+        def sample_write(tick):
+            return sample_bits(host, output_lateness, params.output_eye,
+                taps, 8 * tick, 16)
+
+        ticks = count + READ_LATENCY + 2
+        if self.__config('SG_RESET_N') == 3:
+            commands = self.__sample_commands(rising, falling, cke_n)
+            output = self.sgram.run(
+                commands, ticks, params.temperatures, sample_write)
+        else:
+            output = numpy.ones((INPUT_PINS, 8 * ticks), dtype = numpy.uint8)
+        self.last_ca = (rising[-1], falling[-1])
+
+        # Capture SG output, with EDC captured one tick later than DQ
+        captured = numpy.concatenate((
+            sample_bits(output[:OUTPUT_PINS],
+                input_lateness[:OUTPUT_PINS], params.input_eye[:OUTPUT_PINS],
+                taps, - 8 * CAPTURE_DELAY, 8 * count),
+            sample_bits(output[OUTPUT_PINS:],
+                input_lateness[OUTPUT_PINS:], params.input_eye[OUTPUT_PINS:],
+                taps, - 8 * EDC_CAPTURE_DELAY, 8 * count)))
+
+        # Where the host drives DQ we see our own output
+        loopback = numpy.zeros(count, dtype = bool)
+        loopback[CAPTURE_DELAY:] = oe[:count - CAPTURE_DELAY]
+        if loopback.any():
+            own = sample_bits(host,
+                output_lateness + input_lateness[:OUTPUT_PINS],
+                numpy.minimum(
+                    params.output_eye, params.input_eye[:OUTPUT_PINS]),
+                taps, - 8 * CAPTURE_DELAY, 8 * count)
+            mask = numpy.repeat(loopback, 8)
+            captured[:OUTPUT_PINS, mask] = own[:, mask]
+
+        rows = numpy.ascontiguousarray(
+            numpy.packbits(captured, axis = 1, bitorder = 'little').T)
+        self.captured_dq = rows[:, :DQ_PINS].copy().view(numpy.uint32)
+        self.captured_dbi = \
+            rows[:, DQ_PINS:OUTPUT_PINS].copy().view(numpy.uint32)
+        self.captured_edc = rows[:, OUTPUT_PINS:].copy().view(numpy.uint32)
+
+
+    # Returns the margins in taps or phase steps of the current settings
+    # against the simulated eyes and CA windows.  Negative margins are errors.
+    def margins(self):
+        phase = self.phase
+        if phase >= PHASE_STEPS // 2:
+            phase -= PHASE_STEPS
+        low, high = self.params.ca_windows.T
+        return {
+            'ca': numpy.minimum(phase - low, high - phase),
+            'input': self.params.input_eye // 2 -
+                numpy.abs(self.__input_lateness()),
+            'output': self.params.output_eye // 2 -
+                numpy.abs(self.__output_lateness()),
+        }
+
+
+# Field values returned by _get_fields()
+class _Fields:
+    def __init__(self, values):
+        self._field_names = list(values)
+        self.__dict__.update(values)
+
+    def __repr__(self):
+        return ', '.join(
+            '%s=%d' % (name, getattr(self, name))
+            for name in self._field_names)
+
+
+# A single simulated register supporting the same access methods as the
+# fpga_lib registers used by the tools.
+class SimRegister:
+    def __init__(self, simulation, name):
+        _, fields = register_defines()[name]
+        self.__dict__.update(
+            _simulation = simulation, _name = name,
+            _field_names = list(fields))
+
+    @property
+    def _value(self):
+        return self._simulation.read(self._name)
+
+    @_value.setter
+    def _value(self, value):
+        self._simulation.write(self._name, value)
+
+    def __getattr__(self, name):
+        if name not in self._field_names:
+            raise AttributeError(
+                'No field %s in register %s' % (name, self._name))
+        return unpack_fields(self._name, self._value)[name]
+
+    def __setattr__(self, name, value):
+        if name == '_value':
+            object.__setattr__(self, name, value)
+        else:
+            self._write_fields_rw(**{name: value})
+
+    def _get_fields(self):
+        return _Fields(unpack_fields(self._name, self._value))
+
+    def _write_fields_wo(self, **fields):
+        self._value = pack_fields(self._name, **fields)
+
+    def _write_fields_rw(self, **fields):
+        values = unpack_fields(self._name, self._value)
+        values.update(fields)
+        self._value = pack_fields(self._name, **values)
+
+
+class SimRegisters:
+    def __init__(self, simulation):
+        for name in register_defines():
+            setattr(self, name, SimRegister(simulation, name))
@@ -0,0 +1,205 @@
+# Throughput and latency benchmark for the SGRAM device
+#
+# A run starts a number of reader and writer threads, each issuing blocks of
+# the same size at offsets following the selected access pattern.  Each reader
+# or writer keeps depth requests in flight by running depth threads.  Buffers
+# and offsets are all generated before the run starts so that only the device
+# access is timed, and every request is timed individually to give latency
+# percentiles as well as overall throughput.
+#
+# Any file can be used in place of the SGRAM device, such as a file in /dev/shm,
+# so that the benchmark itself can be tested without hardware.
+
+import os
+import mmap
+import stat
+import time
+import threading
+from collections import namedtuple
+
+import numpy
+
+
+PATTERNS = ['sequential', 'strided', 'random']
+
+# Power of two latency histogram buckets in microseconds
+HISTOGRAM_BUCKETS = 24
+
+# Parameters of a single run.  stride is only used by the strided pattern.
+RunConfig = namedtuple('RunConfig',
+    ['block', 'readers', 'writers', 'depth', 'pattern', 'count', 'stride'])
+
+
+# Parses a size with an optional K, M or G suffix
+def parse_size(string):
+    scale = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    suffix = string[-1:].upper()
+    if suffix in scale:
+        return int(string[:-1], 0) * scale[suffix]
+    else:
+        return int(string, 0)
+
+
+# Returns the default device for the card at address
+def device_path(address = 0):
+    return '/dev/ifc_1412-gddr6.%s.sgram' % address
+
+# Opens the device for reading and writing.  If create is set the path is a
+# file standing in for the device, and is created and extended to size if
+# necessary, otherwise the device must already exist.
+def open_device(path, size, create = False):
+    flags = os.O_RDWR
+    if create:
+        flags |= os.O_CREAT
+    else:
+        assert os.path.exists(path), 'Device %s not found' % path
+    fd = os.open(path, flags, 0o644)
+    info = os.fstat(fd)
+    if create and stat.S_ISREG(info.st_mode) and info.st_size < size:
+        os.ftruncate(fd, size)
+    return fd
+
+
+# Returns a page aligned buffer with every page already touched, filled with
+# random data if rng is given
+def make_buffer(length, rng = None):
+    buffer = mmap.mmap(-1, length)
+    if rng is None:
+        buffer.write(bytes(length))
+    else:
+        buffer.write(rng.bytes(length))
+    return buffer
+
+
+# Returns the offsets of count blocks for thread index out of threads, all
+# within the first size bytes of the device.  Sequential access gives each
+# thread its own slice of the device.
+def make_offsets(config, size, index, threads, rng):
+    blocks = size // config.block
+    assert blocks > 0, 'Block size larger than device'
+    steps = numpy.arange(config.count, dtype = numpy.int64)
+    if config.pattern == 'sequential':
+        span = max(blocks // threads, 1)
+        block_numbers = index * span + steps % span
+    elif config.pattern == 'strided':
+        stride = max(config.stride // config.block, 1)
+        block_numbers = (index + steps * stride) % blocks
+    elif config.pattern == 'random':
+        block_numbers = rng.integers(0, blocks, config.count)
+    else:
+        assert False, 'Unknown pattern %s' % config.pattern
+    return block_numbers % blocks * config.block
+
+
+# A single thread issuing count requests and recording the latency of each in
+# nanoseconds, and the time at which it finished
+class Worker:
+    def __init__(self, fd, write, buffer, offsets):
+        self.fd = fd
+        self.write = write
+        self.buffer = buffer
+        self.offsets = offsets
+        self.latencies = numpy.zeros(len(offsets), dtype = numpy.int64)
+        self.bytes = 0
+        self.finish = None
+
+    def run(self, barrier):
+        fd = self.fd
+        buffer = [self.buffer]
+        data = memoryview(self.buffer)
+        clock = time.perf_counter_ns
+        latencies = self.latencies
+        total = 0
+        barrier.wait()
+        for n, offset in enumerate(self.offsets.tolist()):
+            start = clock()
+            if self.write:
+                total += os.pwrite(fd, data, offset)
+            else:
+                total += os.preadv(fd, buffer, offset)
+            latencies[n] = clock() - start
+        self.finish = time.perf_counter()
+        self.bytes = total
+
+
+# Returns summary statistics for one direction of a run started at start.  The
+# throughput is over the time this direction was active, until its last worker
+# finished, as the other direction may finish earlier or later.
+def summarise(workers, start):
+    if not workers:
+        return None
+    seconds = max(worker.finish for worker in workers) - start
+    latencies = numpy.concatenate([worker.latencies for worker in workers])
+    total = sum(worker.bytes for worker in workers)
+    micros = latencies / 1e3
+    p50, p99, p999 = numpy.percentile(micros, [50, 99, 99.9])
+    buckets = numpy.clip(
+        numpy.ceil(numpy.log2(numpy.maximum(micros, 1))).astype(int),
+        0, HISTOGRAM_BUCKETS - 1)
+    histogram = numpy.bincount(buckets, minlength = HISTOGRAM_BUCKETS)
+    return {
+        'requests': len(latencies),
+        'bytes': total,
+        'seconds': seconds,
+        'mb_per_s': total / seconds / 1e6,
+        'latency_us': {
+            'p50': p50, 'p99': p99, 'p999': p999,
+            'max': float(micros.max()) },
+        # Count of requests taking up to 2**n microseconds, trailing empty
+        # buckets are omitted
+        'histogram_us': histogram[:numpy.flatnonzero(histogram)[-1] + 1]
+            .tolist(),
+    }
+
+
+# Runs one benchmark configuration against the open device of the given size,
+# returns a dictionary of results
+def run(fd, size, config, seed = 0):
+    rng = numpy.random.default_rng(seed)
+    threads = (config.readers + config.writers) * config.depth
+    workers = []
+    for index in range(threads):
+        write = index >= config.readers * config.depth
+        offsets = make_offsets(config, size, index, threads, rng)
+        buffer = make_buffer(config.block, rng if write else None)
+        workers.append(Worker(fd, write, buffer, offsets))
+
+    # All threads are started and wait at the barrier, so that thread start up
+    # is not timed
+    barrier = threading.Barrier(threads + 1)
+    running = [
+        threading.Thread(target = worker.run, args = (barrier,))
+        for worker in workers]
+    for thread in running:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in running:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    for worker in workers:
+        worker.buffer.close()
+    result = dict(config._asdict(), seconds = seconds)
+    result['read'] = summarise(
+        [worker for worker in workers if not worker.write], start)
+    result['write'] = summarise(
+        [worker for worker in workers if worker.write], start)
+    return result
+
+
+# Prints one line for each direction of a list of results from run
+def print_results(results):
+    print('%8s %3s %3s %3s %-10s %-5s %9s %8s %8s %8s' % (
+        'Block', 'R', 'W', 'Q', 'Pattern', 'Dir',
+        'MB/s', 'p50 us', 'p99 us', 'p999 us'))
+    for result in results:
+        for direction in ['read', 'write']:
+            summary = result[direction]
+            if summary:
+                latency = summary['latency_us']
+                print('%8d %3d %3d %3d %-10s %-5s %9.1f %8.1f %8.1f %8.1f' % (
+                    result['block'], result['readers'], result['writers'],
+                    result['depth'], result['pattern'], direction,
+                    summary['mb_per_s'],
+                    latency['p50'], latency['p99'], latency['p999']))
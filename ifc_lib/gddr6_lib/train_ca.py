@@ -0,0 +1,250 @@
+# CA training
+
+from collections import namedtuple
+
+import numpy
+
+from .commands import *
+from .exchange import ExchangeProgram
+from .delays import read_phase, set_phase, advance_phase
+from . import setup
+from . import calibration
+
+
+# Used to set background pattern
+def idle(program, count, pattern = NOP):
+    for i in range(count):
+        program.command(pattern)
+
+def test_pattern(program, phase, pattern):
+    # Compute complementary pattern
+    complement = ~pattern & 0x3FF
+    idle_pattern = (complement, complement)
+    idle(program, 1, idle_pattern)
+    if phase:
+        program.command((complement, pattern), cke_n = 1)
+    else:
+        program.command((pattern, complement), cke_n = 1)
+    idle(program, 1, idle_pattern)
+
+
+def get_raw_result(exch, offset):
+    data, dbi, edc = exch
+    d = data[offset]
+    db = dbi[offset]
+    e = edc[offset - 1]
+    e_db = numpy.stack((e, db)).T
+
+    # Extract the values.  We expect each byte to be either all zeros or all
+    # ones, where a byte represents the result of reading 8 WCK ticks of raw
+    # data from each incoming wire.  We gather these into values according to
+    # the CA to Data Mapping in CA Training Mode.
+    d_val = numpy.packbits((d == 255)[::-1]).astype(numpy.uint16)
+    de_val = numpy.packbits(e_db == 255, 1).astype(numpy.uint16)
+    values = d_val + (de_val[:, 0] << 2)
+
+    # Check that each value is as expected
+    d_good = ((d == 255) | (d == 0)).all()
+    e_db_good = ((e_db == 255) | (e_db == 0)).all()
+    good = d_good and e_db_good
+    return (values, good)
+
+def check_result(exch, offset, expected):
+    values, good = get_raw_result(exch, offset)
+    all_good = good and (values == expected).all()
+    return all_good
+
+# Returns whether all values were valid together with which of the CA lines
+# matched the expected value
+def check_lines(exch, offset, expected):
+    values, good = get_raw_result(exch, offset)
+    bits = 1 << numpy.arange(CA_LINES)
+    return (good, ((values[:, None] ^ expected) & bits == 0).all(0))
+
+
+def create_test_pattern():
+    program = ExchangeProgram()
+
+    test_pattern(program, 0, 0)
+    test_pattern(program, 0, 0x3FF)
+    test_pattern(program, 0, 0x155)
+    test_pattern(program, 0, 0x2AA)
+    test_pattern(program, 0, 0x3FF)
+
+    idle(program, 14)
+    return program.compile()
+
+
+CA_LINES = 10
+# Phases scanned during CA training, from 0 to -(PHASES - 1)
+PHASES = 112
+
+# Rows checked by run_test below, together with the preceding EDC rows
+TEST_ROWS = [16, 17, 19, 20, 22, 23, 25, 26]
+
+# A stored phase is only used if phases this far either side also work
+STORED_MARGIN = 8
+
+# Tests run by run_test as pairs (row, expected value)
+TESTS = [(17, 0), (20, 0x3FF), (23, 0x155), (26, 0x2AA)]
+
+
+# Result of a CA scan.  Windows are (first, last) good phase steps counting
+# down from phase 0, or (-1, -1) where no good phase was seen, and phase is the
+# selected phase.  Phases which were not tested are skipped over.
+CAScan = namedtuple('CAScan', ['phase', 'window', 'line_windows', 'tested'])
+
+# Returns the (first, last) window of True values in good, or (-1, -1)
+def find_window(good):
+    good = numpy.flatnonzero(good)
+    if len(good):
+        return (int(good[0]), int(good[-1]))
+    else:
+        return (-1, -1)
+
+
+class CATraining:
+    def __init__(self, sg, exchange, quiet = 0):
+        self.sg = sg
+        self.exchange = exchange
+        self.quiet = quiet
+        self.test_program = create_test_pattern()
+
+        setup.check_sg_ready(sg)
+        # For CA training we need to ensure that all the training
+        # configuration parameters are reset
+        setup.reset_training_control(sg)
+
+        if not quiet:
+            print('Initial phase =', read_phase(sg))
+
+    def enter_cat(self):
+        self.exchange.reset()
+        self.exchange.command(CAT_PASS1)
+        self.exchange.command(CAT_PASS1)
+        self.exchange.delay(10)
+        self.exchange.command(NOP, cke_n = 1)
+        self.exchange.command(NOP)
+        self.exchange.run()
+
+    # Must be called with one of CAT_EXIT, CAT_PASS1, CAT_PASS2
+    def change_cat(self, command = CAT_EXIT):
+        self.exchange.reset()
+        self.exchange.command(command, cke_n = 1)
+        self.exchange.command(command, cke_n = 1)
+        self.exchange.command(NOP)
+        self.exchange.run()
+
+    # Runs the CA test pattern and returns whether all lines were good
+    # together with which lines were good
+    def run_line_test(self):
+        self.exchange.load(self.test_program)
+        self.exchange.exchange()
+        result = self.exchange.read_rows(TEST_ROWS)
+
+        all_good = True
+        lines = numpy.ones(CA_LINES, dtype = bool)
+        for row, expected in TESTS:
+            good, line_good = check_lines(result, row, expected)
+            all_good = all_good and good
+            lines &= line_good
+        return (all_good and lines.all(), lines)
+
+    def run_test(self):
+        return self.run_line_test()[0]
+
+    # Moves the phase to -step, where the current phase is -self.step.  The
+    # phase is tracked here so that it never needs to be read back.
+    def __walk_to(self, step):
+        advance_phase(self.sg, self.step - step)
+        self.step = step
+
+    def __test_step(self, step, good, lines, tested):
+        self.__walk_to(step)
+        good[step], lines[step] = self.run_line_test()
+        tested[step] = True
+
+    # Scans CA phases from 0 down to -(PHASES - 1) in steps of stride and stops
+    # once every line has passed and then failed again.  If stride is more than
+    # 1 the edges of the combined window and of the window of each line are
+    # then refined by walking back up over the untested phases either side of
+    # each edge, so that every window and margin reported is exact.
+    def scan_ca(self, stride = 1):
+        good = numpy.zeros(PHASES, dtype = bool)
+        lines = numpy.zeros((PHASES, CA_LINES), dtype = bool)
+        tested = numpy.zeros(PHASES, dtype = bool)
+
+        set_phase(self.sg, 0)
+        self.step = 0
+        entered = numpy.zeros(CA_LINES, dtype = bool)
+        for step in range(0, PHASES, stride):
+            self.__test_step(step, good, lines, tested)
+            entered |= lines[step]
+            # Stop when the window has been entered and left on every line
+            if good.any() and entered.all() and not lines[step].any():
+                break
+
+        first, last = find_window(good)
+        assert first >= 0, 'Unable to find any good phase'
+        if stride > 1:
+            refine = set()
+            windows = [(first, last)] + [find_window(line) for line in lines.T]
+            for low, high in windows:
+                if low >= 0:
+                    refine.update(range(high + 1, high + stride))
+                    refine.update(range(low - stride + 1, low))
+            # Walk back up over the falling edges and then the rising edges
+            for step in sorted(refine, reverse = True):
+                if 0 <= step < PHASES and not tested[step]:
+                    self.__test_step(step, good, lines, tested)
+            first, last = find_window(good)
+
+        centre = -(first + last) // 2
+        line_windows = [find_window(line) for line in lines.T]
+        if not self.quiet:
+            print('Window: [{:d}..{:d}] = ({:d} / {:d})'.format(
+                first, last, centre, last - first))
+            for line, (low, high) in enumerate(line_windows):
+                print('CA{:d}: [{:d}..{:d}] margin {:d}'.format(
+                    line, low, high, min(-centre - low, high + centre)))
+        return CAScan(centre, (first, last), line_windows, int(tested.sum()))
+
+    def check_stored_phase(self, phase):
+        for offset in [-STORED_MARGIN, STORED_MARGIN, 0]:
+            set_phase(self.sg, phase + offset)
+            if not self.run_test():
+                return False
+        return True
+
+    # Runs CA training and returns the selected phase.  If a stored calibration
+    # file is given the stored phase is tried first, and unless save is False
+    # the file is updated with the result.  The SGRAM temperature cannot be
+    # read until CA training is complete, so setup_sgram saves the phase itself
+    # once the temperature is known.
+    def train(self, calibration_file = None, stride = 1, save = True):
+        if calibration_file:
+            stored = calibration.load_stage(calibration_file, 'ca')
+        else:
+            stored = None
+
+        # Enable CA Training (CAT)
+        self.enter_cat()
+        if stored and self.check_stored_phase(stored['phase']):
+            ca_phase = stored['phase']
+            if not self.quiet:
+                print('Using stored CA phase', ca_phase)
+        else:
+            # Inspect all CA phases in the range 0 to -180 degrees
+            ca_phase = self.scan_ca(stride).phase
+        # Restore normal operation (exit CAT)
+        self.change_cat(CAT_EXIT)
+
+        set_phase(self.sg, ca_phase)
+        phase = read_phase(self.sg)
+        if self.quiet < 2:
+            print('CA phase: {:d} = {:.1f} degrees'.format(
+                phase, phase / 56 * 90))
+
+        if calibration_file and save:
+            calibration.save_stage(calibration_file, 'ca', phase = phase)
+        return phase
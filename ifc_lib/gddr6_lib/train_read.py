@@ -0,0 +1,267 @@
+# Read training
+
+import numpy
+
+from .commands import *
+from .schedule import Scheduler
+from .display import *
+from .delays import TARGET_IDELAY, TARGET_IBITSLIP
+from . import setup
+from . import search
+from . import eyes
+from . import calibration
+
+
+TEST_PATTERNS = [0xCCA0, 0x5500, 0x33CC, 0x1248, 0x5555, 0x0055]
+
+PINS = 80
+MAX_DELAY = 500
+
+DATA_OFFSET = 31
+DATA_LENGTH = 12
+DATA_RANGE = numpy.s_[DATA_OFFSET:DATA_OFFSET + DATA_LENGTH]
+EDC_RANGE = numpy.s_[DATA_OFFSET + 1:DATA_OFFSET + 1 + DATA_LENGTH]
+# Only these rows need to be read when matching data
+MATCH_ROWS = numpy.s_[DATA_OFFSET:DATA_OFFSET + 1 + DATA_LENGTH]
+
+# Stored delays are only kept on pins which also work at these offsets, which
+# are close enough together that a pin sitting on the edge of its eye next to a
+# short spurious pass will not be accepted.  The stored delays are tested last.
+STORED_OFFSETS = [-16, -8, 8, 16, 0]
+
+
+def load_pattern(scheduler, pattern):
+    for b in range(16):
+        bits = 0x3FF if (pattern >> b) & 1 else 0
+        scheduler.command(LDFF(b, bits))
+
+def extend(range):
+    return numpy.s_[range.start-1 : range.stop + 1]
+
+def match_data(data, dbi, edc):
+    data = data[DATA_RANGE]
+    dbi = dbi[DATA_RANGE]
+    edc = edc[EDC_RANGE]
+    data = numpy.concatenate((data, dbi, edc), axis = 1)
+    pattern = numpy.array(TEST_PATTERNS, dtype = 'uint16').view('uint8')
+    return (data == pattern[:, None]).all(0)
+
+def count_offset(byte):
+    for n in range(8):
+        if byte == 0:
+            return n
+        else:
+            byte = (byte << 1) & 0xFF
+    assert False, 'Unable to find bitslip offset'
+
+
+# Training of input bitslips and IDELAYs.  The training steps are called in
+# order by train(), or individually by the train-read tool.  Only the pins
+# selected by retrain are changed, which is all pins unless a stored
+# calibration has been restored.
+class ReadTraining:
+    def __init__(self, sg, exchange, delay_bank, quiet = 0):
+        self.sg = sg
+        self.exchange = exchange
+        self.delay_bank = delay_bank
+        self.quiet = quiet
+
+        self.retrain = numpy.ones(PINS, dtype = bool)
+        self.bitslips = None
+        self.delays = numpy.zeros(PINS, dtype = int)
+        self.windows = numpy.zeros(PINS, dtype = int)
+
+        setup.check_sg_ready(sg)
+        sg.CONFIG._write_fields_rw(
+            # Can't have controller in charge
+            ENABLE_CONTROL = 0,
+            ENABLE_REFRESH = 0,
+            ENABLE_AXI = 0,
+            # Send commands unmodified
+            ENABLE_CABI = 0,
+            # Want to disable DBI for reception
+            ENABLE_DBI = 0,
+            # Ensure DBI register captures DBI
+            CAPTURE_EDC_OUT = 0)
+
+    # Loads the test patterns into the read FIFO
+    def load_patterns(self):
+        scheduler = Scheduler()
+        for pattern in TEST_PATTERNS:
+            load_pattern(scheduler, pattern)
+        scheduler.run(self.exchange)
+        if not self.quiet:
+            print('Pattern load:', scheduler.report())
+
+    # Read test pattern.  If rows is specified only the selected rows are read
+    def read_test(self, rows = None):
+        exchange = self.exchange
+        exchange.reset()
+        exchange.command(PREab)
+        exchange.delay(4)
+        exchange.command(REFab)
+        exchange.delay(4)
+        for i in range(6):
+            exchange.command(RDTR)
+            exchange.delay(1)
+        exchange.delay(24)
+        exchange.exchange()
+        return exchange.read_rows(rows)
+
+    # Returns which pins read back the test pattern correctly
+    def test(self):
+        data, dbi, edc = self.read_test(MATCH_ROWS)
+        return match_data(data, dbi, edc)
+
+    # Applies a stored calibration and selects the pins which fail with it for
+    # retraining
+    def restore(self, stored):
+        self.bitslips = stored['bitslips']
+        self.delays = stored['delays']
+        self.windows = stored['windows']
+        self.delay_bank.set_ibitslips(self.bitslips)
+
+        self.retrain[:] = False
+        for offset in STORED_OFFSETS:
+            self.delay_bank.set_idelays(
+                numpy.clip(self.delays + offset, 0, 511))
+            self.retrain |= ~self.test()
+        if self.quiet < 2:
+            print('Read calibration restored, %d pins to retrain' %
+                self.retrain.sum())
+
+    def reset(self, set_bitslip = None, reset_bitslip = False,
+            reset_idelay = False):
+        if set_bitslip is not None:
+            self.delay_bank.set_ibitslips(set_bitslip, self.retrain)
+        elif reset_bitslip:
+            self.delay_bank.set_ibitslips(0, self.retrain)
+        if reset_idelay:
+            self.delay_bank.set_idelays(0, self.retrain)
+
+    def show(self, channel = 0, show_exchange = False):
+        data, dbi, edc = self.read_test()
+        if show_exchange and not self.quiet:
+            print_condensed_data_edc(data, dbi, edc, offset = 29)
+        if not self.quiet:
+            print('Data:')
+            show_channel(data[extend(DATA_RANGE)], channel)
+            print('DBI:')
+            for ix in range(8):
+                print_bits(ix, dbi[extend(DATA_RANGE), ix])
+            print('EDC:')
+            for ix in range(8):
+                print_bits(ix, edc[extend(EDC_RANGE), ix])
+            print(show_match(match_data(data, dbi, edc)))
+
+    # Search for best bitslip
+    def find_bitslip(self):
+        if not self.retrain.any():
+            return
+        data, dbi, edc = self.read_test(MATCH_ROWS)
+        data = numpy.concatenate((
+            data[DATA_OFFSET + 11], dbi[DATA_OFFSET + 11],
+            edc[DATA_OFFSET + 12]))
+        offsets = [
+            count_offset(b) if r else 0 for b, r in zip(data, self.retrain)]
+        if not self.quiet:
+            print(offsets)
+        self.delay_bank.set_ibitslips(
+            [max(0, o - 1) for o in offsets], self.retrain)
+        self.bitslips = self.delay_bank.get(TARGET_IBITSLIP)
+
+    # Sets the given delays on the pins being trained and returns which of them
+    # read back correctly
+    def test_delays(self, delays):
+        all_delays = self.delay_bank.get(TARGET_IDELAY)
+        all_delays[self.retrain] = delays
+        self.delay_bank.set_idelays(all_delays)
+        return self.test()[self.retrain]
+
+    def find_eyes(self, strategy = 'bisect', stride = 32, verify = 8):
+        intervals = []
+        centres, lengths = search.search_eyes(
+            self.test_delays, self.retrain.sum(), MAX_DELAY,
+            strategy, stride, verify, intervals)
+        if not self.quiet:
+            for pin_intervals in intervals:
+                if len(pin_intervals) > 1:
+                    print('intervals:', pin_intervals)
+            print(lengths.tolist())
+            print(centres.tolist())
+        return (centres, lengths)
+
+    # Records a sweep of every delay on all pins and saves it together with the
+    # current bitslips.  The current delays are restored afterwards.
+    def record_sweep(self, filename):
+        saved = self.delay_bank.get(TARGET_IDELAY)
+        def test(delays):
+            self.delay_bank.set_idelays(delays)
+            return self.test()
+        matches = search.sweep_delays(test, PINS, MAX_DELAY)
+        self.delay_bank.set_idelays(saved)
+        eyes.save_sweep(filename, matches,
+            bitslips = self.delay_bank.get(TARGET_IBITSLIP))
+
+    def benchmark(self, stride = 32, verify = 8):
+        search.print_benchmark(search.benchmark(
+            self.test_delays, self.retrain.sum(), MAX_DELAY, stride, verify))
+
+    # Finds the eyes of the pins being trained and sets each pin to the centre
+    # of its eye.  Returns False if any pin has no eye.
+    def sweep(self, strategy = 'bisect', stride = 32, verify = 8):
+        if self.retrain.any():
+            self.delays[self.retrain], self.windows[self.retrain] = \
+                self.find_eyes(strategy, stride, verify)
+        if self.windows.all():
+            if self.quiet < 2:
+                print('Read window:',
+                    self.windows.min(), 'to', self.windows.max())
+            self.delay_bank.set_idelays(self.delays)
+            return True
+        else:
+            print('Not enough data eyes found')
+            print(self.windows.tolist())
+            return False
+
+    def create_report(self, report):
+        with open(report, 'w') as report:
+            def print_array(array):
+                print(' '.join(map(str, array)), file = report)
+            print_array(self.bitslips)
+            print_array(self.delays)
+            print_array(self.windows)
+
+    def validate(self):
+        match = self.test()
+        if not self.quiet or not match.all():
+            print(show_match(match))
+        assert match.all(), 'Read training failed'
+
+    def save(self, calibration_file, temperature = None):
+        calibration.save_stage(calibration_file, 'read', temperature,
+            bitslips = self.delay_bank.get(TARGET_IBITSLIP),
+            delays = self.delays, windows = self.windows)
+
+    # Runs complete read training, starting from the stored calibration if a
+    # calibration file is given.  If the SGRAM temperature is given the stored
+    # calibration for this temperature is used and updated.  Returns the eye
+    # widths.
+    def train(self, calibration_file = None, report = None,
+            strategy = 'bisect', stride = 32, verify = 8, temperature = None):
+        self.load_patterns()
+        stored = None
+        if calibration_file:
+            stored = calibration.load_stage(
+                calibration_file, 'read', temperature)
+        if stored:
+            self.restore(stored)
+        self.reset(reset_bitslip = True, reset_idelay = True)
+        self.find_bitslip()
+        ok = self.sweep(strategy, stride, verify)
+        if report:
+            self.create_report(report)
+        self.validate()
+        if calibration_file and ok:
+            self.save(calibration_file, temperature)
+        return self.windows
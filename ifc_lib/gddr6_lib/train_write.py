@@ -0,0 +1,501 @@
+# Write training
+
+import time
+import numpy
+
+from .commands import *
+from .exchange import ExchangeProgram
+from .display import *
+from .delays import TARGET_ODELAY, TARGET_OBITSLIP, read_odelay
+from . import setup
+from . import search
+from . import eyes
+from . import calibration
+
+
+TEST_PATTERNS = [0xFF00, 0xCC3C, 0x55AC, 0x5555, 0xA555, 0x00AA]
+# TEST_PATTERNS = [0, 0, 0xFFFF, 0xFFFF, 0, 0]
+
+PINS = 72
+BITSLIPS = 8
+MAX_DELAY = 500
+
+# Difference in width, in delay taps, allowed between complete eyes at
+# different bitslips before the pruned bitslip search falls back to searching
+# every bitslip
+WIDTH_TOLERANCE = 2
+
+DATA_OFFSET = 34
+DATA_RANGE = numpy.s_[DATA_OFFSET:DATA_OFFSET+12]
+
+# Stored delays are only kept on pins which also work at these offsets, which
+# are close enough together that a pin sitting on the edge of its eye next to a
+# short spurious pass will not be accepted.  The stored delays are tested last.
+STORED_OFFSETS = [-16, -8, 8, 16, 0]
+
+
+# Returns DQ and DBI words for a row with every pin set to byte
+def dq_words(byte):
+    pattern = byte | (byte << 8) | (byte << 16) | (byte << 24)
+    return (16 * [pattern], 2 * [pattern])
+
+
+# Iterator to generate DQ pattern at the correct place.  Returns the byte to
+# write together with the appropriate output enable setting
+def write_dq_array(delay):
+    for n in range(delay-1):
+        yield (0xFF, False)
+
+    yield (0xFF, True)
+
+    for i in range(6):
+        yield (TEST_PATTERNS[i] & 0xFF, True)
+        yield (TEST_PATTERNS[i] >> 8, True)
+
+    yield (0xFF, True)
+
+    while True:
+        yield (0xFF, False)
+
+
+def create_exchange():
+    program = ExchangeProgram()
+    dq = write_dq_array(3)
+
+    def command(command):
+        byte, oe = next(dq)
+        data, dbi = dq_words(byte)
+        program.command(command, oe = oe, data = data, dbi = dbi)
+
+    program.command(ACT(0, 0))
+    # Use WRTR to load the training pattern
+    for _ in range(6):
+        command(WRTR)
+        command(NOP)
+    # Use RDTR to read the pattern back
+    for _ in range(6):
+        command(RDTR)
+        command(NOP)
+    # Run out for long enough to see the response
+    for _ in range(21):
+        command(NOP)
+    program.command(NOP)
+    return program.compile()
+
+
+def show_data(data, dbi, name, offset, channel):
+    data_range = numpy.s_[offset-1:offset+13]
+    print('Data %s:' % name)
+    for n in range(0, 16):
+        ix = n + 16 * channel
+        print_bits(ix, data[data_range, ix])
+    print('DBI %s:' % name)
+    for n in range(8):
+        print_bits(n, dbi[data_range, n])
+
+def match_data(data, dbi):
+    data = numpy.concatenate((data, dbi), axis = 1)
+    data = data[DATA_RANGE]
+    pattern = numpy.array(TEST_PATTERNS, dtype = 'uint16').view('uint8')
+    return (data == pattern[:, None]).all(0)
+
+
+def print_matlab_value(value):
+    if len(value.shape) == 0:
+        print(value, end = ', ')
+    else:
+        print('[ ', end = '')
+        for row in value:
+            print_matlab_value(row)
+        print(']; ...')
+
+# Prints array in format that can be loaded into matlab
+def print_matlab(name, array):
+    print(name, '=', '...')
+    print_matlab_value(array)
+    print()
+
+def count_offset(byte):
+    for n in range(8):
+        if byte == 0:
+            return n
+        else:
+            byte = (byte << 1) & 0xFF
+    assert False, 'Unable to find bitslip offset'
+
+
+# Training of output bitslips and ODELAYs.  The training steps are called in
+# order by train(), or individually by the train-write tool.  Only the pins
+# selected by retrain are changed, which is all pins unless a stored
+# calibration has been restored.
+class WriteTraining:
+    def __init__(self, sg, exchange, delay_bank, quiet = 0):
+        self.sg = sg
+        self.exchange = exchange
+        self.delay_bank = delay_bank
+        self.quiet = quiet
+        self.test_program = create_exchange()
+        # Count of test exchanges run
+        self.exchanges = 0
+
+        self.retrain = numpy.ones(PINS, dtype = bool)
+        self.bitslips = None
+        self.odelays = numpy.zeros(PINS, dtype = int)
+        self.windows = numpy.zeros(PINS, dtype = int)
+
+        setup.check_sg_ready(sg)
+        sg.CONFIG.DBI_TRAINING = 1
+
+    # Runs the test exchange.  If rows is specified only the selected rows are
+    # read back
+    def write_test(self, rows = None):
+        self.exchange.load(self.test_program)
+        self.exchange.exchange()
+        self.exchanges += 1
+        data, dbi, _ = self.exchange.read_rows(rows)
+        return (data, dbi)
+
+    # Returns which pins wrote the test pattern correctly
+    def test(self):
+        data, dbi = self.write_test(DATA_RANGE)
+        return match_data(data, dbi)
+
+    # Applies a stored calibration and selects the pins which fail with it for
+    # retraining
+    def restore(self, stored):
+        self.bitslips = stored['bitslips']
+        self.odelays = stored['delays']
+        self.windows = stored['windows']
+        self.delay_bank.set_obitslips(self.bitslips)
+
+        self.retrain[:] = False
+        for offset in STORED_OFFSETS:
+            self.delay_bank.set_odelays(
+                numpy.clip(self.odelays + offset, 0, 511))
+            self.retrain |= ~self.test()
+        if self.quiet < 2:
+            print('Write calibration restored, %d pins to retrain' %
+                self.retrain.sum())
+
+    def reset(self, set_bitslip = None, reset_bitslip = False,
+            reset_odelay = False):
+        if set_bitslip is not None:
+            self.delay_bank.set_obitslips(set_bitslip, self.retrain)
+        elif reset_bitslip:
+            self.delay_bank.set_obitslips(0, self.retrain)
+        if reset_odelay:
+            self.delay_bank.set_odelays(0, self.retrain)
+
+    def show(self, channel = 0, show_exchange = False, data_out = False):
+        data, dbi = self.write_test()
+        if show_exchange:
+            print_condensed_data_dbi(data, dbi)
+        if data_out:
+            show_data(data, dbi, 'Out', 17, channel)
+        if not self.quiet:
+            show_data(data, dbi, 'In', DATA_OFFSET, channel)
+            print(show_match(match_data(data, dbi)))
+
+    # Predicts the bitslip of each pin from the offset of the captured pattern
+    def predict_bitslips(self):
+        data, dbi = self.write_test(DATA_RANGE)
+        data = numpy.concatenate((data, dbi), axis = 1)
+        last_column = data[DATA_OFFSET + 11]
+        offsets = [
+            count_offset(b) if r else 0
+            for b, r in zip(last_column, self.retrain)]
+        if not self.quiet:
+            print(offsets)
+        return numpy.array([max(0, o - 1) for o in offsets])
+
+    # Search for best bitslip
+    def find_bitslip(self):
+        if not self.retrain.any():
+            return
+        self.delay_bank.set_obitslips(self.predict_bitslips(), self.retrain)
+        self.bitslips = self.delay_bank.get(TARGET_OBITSLIP)
+
+    # Sets the given delays on the pins being trained and returns which of them
+    # wrote correctly
+    def test_delays(self, delays):
+        all_delays = self.delay_bank.get(TARGET_ODELAY)
+        all_delays[self.retrain] = delays
+        self.delay_bank.set_odelays(all_delays)
+        return self.test()[self.retrain]
+
+    def find_eyes(self, strategy = 'bisect', stride = 32, verify = 8):
+        return search.search_eyes(
+            self.test_delays, self.retrain.sum(), MAX_DELAY,
+            strategy, stride, verify)
+
+    # Records a sweep of every delay on all pins and saves it together with the
+    # current bitslips.  The current delays are restored afterwards.
+    def record_sweep(self, filename):
+        saved = self.delay_bank.get(TARGET_ODELAY)
+        def test(delays):
+            self.delay_bank.set_odelays(delays)
+            return self.test()
+        matches = search.sweep_delays(test, PINS, MAX_DELAY)
+        self.delay_bank.set_odelays(saved)
+        eyes.save_sweep(filename, matches,
+            bitslips = self.delay_bank.get(TARGET_OBITSLIP))
+
+    def benchmark(self, stride = 32, verify = 8):
+        search.print_benchmark(search.benchmark(
+            self.test_delays, self.retrain.sum(), MAX_DELAY, stride, verify))
+
+    # Searches for eyes on all pins at every bitslip, returns (odelays,
+    # windows) indexed by bitslip and pin
+    def search_all_bitslips(self, strategy = 'bisect', stride = 32, verify = 8):
+        self.retrain[:] = True
+        odelays = numpy.zeros((BITSLIPS, PINS), dtype = numpy.int64)
+        windows = numpy.zeros((BITSLIPS, PINS), dtype = numpy.int64)
+        for bitslip in range(BITSLIPS):
+            if not self.quiet:
+                print('bitslip', bitslip)
+            self.delay_bank.set_obitslips(bitslip)
+            odelays[bitslip], windows[bitslip] = \
+                self.find_eyes(strategy, stride, verify)
+        return (odelays, windows)
+
+    # Searches for eyes with each pin at its own bitslip, testing only delays
+    # in the range low to high on each pin.  Delays outside the full range of
+    # delays are treated as failing, as for a search over the full range.
+    def __search_range(self, bitslips, low, high, strategy, stride, verify):
+        self.retrain[:] = True
+        self.delay_bank.set_obitslips(bitslips)
+        def test(delays):
+            delays = low + delays
+            ok = self.test_delays(numpy.minimum(delays, MAX_DELAY - 1))
+            return ok & (delays < high)
+        span = max(1, int((high - low).max()))
+        centres, lengths = search.search_eyes(
+            test, PINS, span, strategy, stride, verify)
+        return (low + centres, lengths)
+
+    def __search_full(self, bitslips, strategy, stride, verify):
+        return self.__search_range(
+            bitslips, numpy.zeros(PINS, dtype = int),
+            numpy.full(PINS, MAX_DELAY), strategy, stride, verify)
+
+    # Finds the same bitslip for each pin as search_all_bitslips, but only
+    # searches the bitslips which can give the widest eye.  Returns (odelays,
+    # windows) as for search_all_bitslips with zero windows for bitslips which
+    # were not searched.
+    #
+    # Each bitslip moves the eye by a fixed number of delay taps, so after
+    # searching the predicted bitslip and one neighbour the eye position at
+    # every bitslip is known.  The widest eye is the eye at the lowest bitslip
+    # which fits inside the delay range, and this bitslip is checked together
+    # with its neighbours over a range of delays around the predicted eye.
+    # Pins whose eye does not lie within its predicted range are searched over
+    # the full range, and if the eye step can't be measured every bitslip is
+    # searched.
+    #
+    # This assumes that every eye not truncated by the ends of the delay range
+    # has the same width, whereas the exhaustive search picks the strictly
+    # widest eye.  Pins where the selected eye touches an end of the range or
+    # where the eyes found differ in width by more than WIDTH_TOLERANCE are
+    # therefore searched at every bitslip.
+    def search_pruned_bitslips(
+            self, strategy = 'bisect', stride = 32, verify = 8):
+        self.retrain[:] = True
+        self.delay_bank.set_obitslips(0)
+        self.delay_bank.set_odelays(0)
+        predicted = self.predict_bitslips()
+
+        odelays = numpy.zeros((BITSLIPS, PINS), dtype = numpy.int64)
+        windows = numpy.zeros((BITSLIPS, PINS), dtype = numpy.int64)
+        searched = numpy.zeros((BITSLIPS, PINS), dtype = bool)
+        pins = numpy.arange(PINS)
+        def record(bitslips, result, mask = True):
+            mask = mask & ~searched[bitslips, pins]
+            odelays[bitslips[mask], pins[mask]] = result[0][mask]
+            windows[bitslips[mask], pins[mask]] = result[1][mask]
+            searched[bitslips[mask], pins[mask]] = True
+
+        # Search the predicted bitslip and one neighbour over the full range
+        neighbour = numpy.where(predicted > 0, predicted - 1, predicted + 1)
+        for bitslips in [predicted, neighbour]:
+            record(bitslips,
+                self.__search_full(bitslips, strategy, stride, verify))
+
+        # The step between eyes is the same for all pins, so measure it using
+        # the pins where both eyes lie entirely inside the range
+        width = windows[predicted, pins]
+        centres = odelays[predicted, pins]
+        inside = searched & (windows > 0) & \
+            (odelays - (windows + 1) // 2 > 0) & \
+            (odelays + (windows + 1) // 2 < MAX_DELAY - 1)
+        both = inside[predicted, pins] & inside[neighbour, pins]
+        if not both.any():
+            return self.search_all_bitslips(strategy, stride, verify)
+        step = numpy.median(
+            (odelays[neighbour, pins] - centres)[both] /
+            (predicted - neighbour)[both])
+        if step < 1:
+            return self.search_all_bitslips(strategy, stride, verify)
+
+        # The lowest bitslip at which the eye fits below the top of the range
+        best = numpy.ceil(
+            predicted - (MAX_DELAY - 1 - (width + 1) // 2 - centres) / step)
+        best = numpy.clip(best, 0, BITSLIPS - 1).astype(int)
+        for offset in [-1, 0, 1]:
+            bitslips = best + offset
+            valid = (0 <= bitslips) & (bitslips < BITSLIPS)
+            bitslips = numpy.clip(bitslips, 0, BITSLIPS - 1)
+            expected = numpy.round(
+                centres + (predicted - bitslips) * step).astype(int)
+            low = numpy.clip(expected - width, 0, MAX_DELAY)
+            high = numpy.clip(expected + width, 0, MAX_DELAY)
+            result = self.__search_range(
+                bitslips, low, high, strategy, stride, verify)
+            # Eyes touching the edge of a restricted range may be truncated
+            c, l = result
+            clipped = (l > 0) & (
+                ((c - (l + 1) // 2 <= low) & (low > 0)) |
+                ((c + (l + 1) // 2 >= high - 1) & (high < MAX_DELAY)))
+            record(bitslips, result, valid & ~clipped)
+            if (valid & clipped).any():
+                full = self.__search_full(bitslips, strategy, stride, verify)
+                record(bitslips, full, valid & clipped)
+
+        suspect = self.__check_pruned(odelays, windows, searched)
+        if suspect.any():
+            if not self.quiet:
+                print('Searching all bitslips on %d pins' % suspect.sum())
+            for bitslip in range(BITSLIPS):
+                if (suspect & ~searched[bitslip]).any():
+                    bitslips = numpy.full(PINS, bitslip)
+                    record(bitslips,
+                        self.__search_full(bitslips, strategy, stride, verify),
+                        suspect)
+        return (odelays, windows)
+
+    # Returns the pins where the result of the pruned search can't be trusted:
+    # either the widest eye found touches an end of the delay range, or the
+    # complete eyes found are not all the same width
+    def __check_pruned(self, odelays, windows, searched):
+        half = (windows + 1) // 2
+        truncated = (odelays - half <= 0) | (odelays + half >= MAX_DELAY - 1)
+        complete = searched & (windows > 0) & ~truncated
+        best = numpy.argmax(windows, axis = 0)
+        at_edge = truncated[best, numpy.arange(PINS)]
+        widest = numpy.where(complete, windows, 0).max(axis = 0)
+        narrowest = numpy.where(complete, windows, MAX_DELAY).min(axis = 0)
+        unequal = complete.any(axis = 0) & \
+            (widest - narrowest > WIDTH_TOLERANCE)
+        return at_edge | unequal
+
+    # Applies the bitslip with the widest eye on each pin from the result of
+    # one of the bitslip searches.  The first bitslip wins a tie.
+    def select_bitslips(self, odelays, windows):
+        best = numpy.argmax(windows, axis = 0)
+        pins = numpy.arange(PINS)
+        self.delay_bank.set_obitslips(best)
+        self.delay_bank.set_odelays(odelays[best, pins])
+        return best
+
+    # Scans all pins at every bitslip and selects the bitslip with the widest
+    # eye for each pin.  Unless exhaustive is set only the bitslips which can
+    # give the widest eye are searched.
+    def scan_bitslips(self, strategy = 'bisect', stride = 32, verify = 8,
+            exhaustive = False):
+        if exhaustive:
+            odelays, windows = \
+                self.search_all_bitslips(strategy, stride, verify)
+        else:
+            odelays, windows = \
+                self.search_pruned_bitslips(strategy, stride, verify)
+
+        print_matlab('odelays', odelays)
+        print_matlab('windows', windows)
+        print(windows.max(axis = 0))
+
+        print(self.select_bitslips(odelays, windows))
+
+        # The report shows the results for every bitslip
+        self.bitslips = list(range(BITSLIPS))
+        self.odelays = odelays
+        self.windows = windows
+
+    # Compares the pruned bitslip search against searching every bitslip
+    def benchmark_bitslips(self, strategy = 'bisect', stride = 32, verify = 8):
+        results = []
+        for name, action in [
+                ('all', self.search_all_bitslips),
+                ('pruned', self.search_pruned_bitslips)]:
+            exchanges = self.exchanges
+            start = time.time()
+            odelays, windows = action(strategy, stride, verify)
+            seconds = time.time() - start
+            exchanges = self.exchanges - exchanges
+            best = numpy.argmax(windows, axis = 0)
+            results.append((name, exchanges, seconds, best,
+                odelays[best, numpy.arange(PINS)]))
+
+        _, all_exchanges, all_seconds, all_best, all_odelays = results[0]
+        for name, exchanges, seconds, best, odelays in results:
+            differ = (best != all_best) | (odelays != all_odelays)
+            print('%-8s %5d exchanges %7.3f s  speed-up %5.1f, %d pins differ'
+                % (name, exchanges, seconds, all_seconds / seconds,
+                    differ.sum()))
+
+    # Finds the eyes of the pins being trained and sets each pin to the centre
+    # of its eye.  Returns False if any pin has no eye.
+    def scan(self, strategy = 'bisect', stride = 32, verify = 8):
+        if self.retrain.any():
+            self.odelays[self.retrain], self.windows[self.retrain] = \
+                self.find_eyes(strategy, stride, verify)
+        if not self.quiet:
+            print(list(self.odelays), ';')
+            print(list(self.windows), ';')
+        if self.quiet < 2:
+            print('Write window:', self.windows.min(), 'to', self.windows.max())
+        self.delay_bank.set_odelays(self.odelays)
+        return self.windows.all()
+
+    def create_report(self, report, append = False):
+        mode = 'a' if append else 'w'
+        with open(report, mode) as report:
+            def print_array(array):
+                print(' '.join(map(str, array)), file = report)
+            print_array(self.bitslips)
+            print_array(self.odelays)
+            print_array(self.windows)
+
+    def validate(self):
+        # Read back an odelay to synchronise with setting
+        read_odelay(self.sg, 0)
+        match = self.test()
+        if not self.quiet:
+            print(show_match(match))
+        assert match.all(), 'Write training failed'
+
+    def save(self, calibration_file, temperature = None):
+        calibration.save_stage(calibration_file, 'write', temperature,
+            bitslips = self.delay_bank.get(TARGET_OBITSLIP),
+            delays = self.delay_bank.get(TARGET_ODELAY),
+            windows = self.windows)
+
+    # Runs complete write training, starting from the stored calibration if a
+    # calibration file is given.  If the SGRAM temperature is given the stored
+    # calibration for this temperature is used and updated.  Returns the eye
+    # widths.
+    def train(self, calibration_file = None, report = None, append = False,
+            strategy = 'bisect', stride = 32, verify = 8, temperature = None):
+        stored = None
+        if calibration_file:
+            stored = calibration.load_stage(
+                calibration_file, 'write', temperature)
+        if stored:
+            self.restore(stored)
+        self.reset(reset_bitslip = True, reset_odelay = True)
+        self.find_bitslip()
+        ok = self.scan(strategy, stride, verify)
+        if report:
+            self.create_report(report, append)
+        self.validate()
+        if calibration_file and ok:
+            self.save(calibration_file, temperature)
+        return self.windows
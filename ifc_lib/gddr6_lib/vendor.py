@@ -0,0 +1,67 @@
+# Read Vendor IDs and temperatures
+
+from collections import namedtuple
+
+from .commands import *
+from .display import print_condensed_data, condense_data
+from . import setup
+
+
+VendorId = namedtuple('VendorId', ['id1', 'id2', 'temperatures'])
+
+# Expected vendor IDs for our SG RAM
+EXPECTED_ID1 = 0xEB1F
+EXPECTED_ID2 = 0xFFFC
+
+
+# Reads and checks the vendor IDs and temperatures and returns them as a
+# VendorId.  The raw exchange data is printed unless quiet is set.
+def read_vendor(sg, exchange, quiet = True):
+    setup.check_sg_ready(sg)
+
+    exchange.reset()
+    exchange.command(VENDOR_ID1)
+    exchange.delay(3)
+    exchange.command(VENDOR_ID2)
+    exchange.delay(3)
+    exchange.command(READ_TEMPS)
+    exchange.delay(3)
+    exchange.command(VENDOR_OFF)
+    exchange.delay(15)
+    data = exchange.run()
+
+    offset = 14
+    if not quiet:
+        print_condensed_data(data, offset = offset)
+
+    ID1, id1_good = condense_data(data[offset + 3])
+    ID2, id2_good = condense_data(data[offset + 7])
+    temps, t_good = condense_data(data[offset + 11])
+
+    assert id1_good.all(), 'Bad ID1 reading'
+    assert (ID1[0] == ID1).all(), 'Inconsistent ID1: %s' % ID1
+    assert id2_good.all(), 'Bad ID2 reading'
+    assert (ID2[0] == ID2).all(), 'Inconsistent ID2: %s' % ID2
+    assert t_good.all(), 'Bad temperature reading'
+    assert (temps & 0xFF == temps >> 8).all(), \
+        'Inconstent temperature readings: %s' % temps
+
+    return VendorId(int(ID1[0]), int(ID2[0]), 2 * (temps & 0xFF) - 40)
+
+# Reads and checks the vendor IDs and temperatures, returns the temperatures in
+# degrees for each channel.  The IDs are printed unless quiet is 2 or more.
+def read_vid(sg, exchange, quiet = True):
+    result = read_vendor(sg, exchange, quiet)
+    if quiet < 2:
+        print(
+            'ID1: %04X, ID2: %04X,' % (result.id1, result.id2),
+            'Temperatures:', result.temperatures, 'degrees')
+
+    assert result.id1 == EXPECTED_ID1 and result.id2 == EXPECTED_ID2, \
+        'Unexpected ID1 or ID2'
+    return result
+
+# Returns the mean SGRAM die temperature in degrees.  Unlike the TEMPS register
+# this works while the controller is disabled, but CA training must be complete.
+def read_temperature(sg, exchange):
+    return float(read_vendor(sg, exchange).temperatures.mean())
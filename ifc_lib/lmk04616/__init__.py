@@ -2,5 +2,7 @@ from .setup_lmk import *
 
 from .bind_lmk import *
 
+from .image_lmk import *
+
 from .setup_sys_lmk import create_config as create_sys_config
 from .setup_acq_lmk import create_config as create_acq_config
@@ -1,32 +1,130 @@
 # Given LMK register return bindings
 
 import time
+import contextlib
 
 from fpga_lib import devices
 
 
+# Counts and total time of each kind of register operation
+class SpiStats:
+    OPERATIONS = ['select', 'write', 'read']
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counts = dict.fromkeys(self.OPERATIONS, 0)
+        self.seconds = dict.fromkeys(self.OPERATIONS, 0.0)
+
+    @contextlib.contextmanager
+    def timing(self, operation):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.counts[operation] += 1
+            self.seconds[operation] += time.time() - start
+
+    def __str__(self):
+        return ', '.join(
+            '%s: %d in %.3f s' % (op, self.counts[op], self.seconds[op])
+            for op in self.OPERATIONS)
+
+
 # read/write/reset bindings for LMK
+#
+# Both LMKs are reached through the same register, and SELECT is only written
+# when it needs to change.  Writes made inside batch() are queued and written in
+# a single pass when the batch ends or before the next read.
 class RawLMK:
+    # Current SELECT setting of each LMK04616 register, shared between the SYS
+    # and ACQ instances.  This assumes no other process changes SELECT.
+    _selected = {}
+
     # Call with select = 'sys' for SYS LMK, 'acq' for ACQ LMK
     def __init__(self, lmk, select):
         self.__lmk = lmk
         self.__select = { 'acq' : 1, 'sys' : 0 }[select]
+        self.__queue = None
+        self.stats = SpiStats()
+
+    def __set_select(self):
+        if RawLMK._selected.get(id(self.__lmk)) != self.__select:
+            with self.stats.timing('select'):
+                self.__lmk._write_fields_wo(SELECT = self.__select)
+            RawLMK._selected[id(self.__lmk)] = self.__select
+
+    def __write(self, reg, value):
+        with self.stats.timing('write'):
+            self.__lmk._write_fields_wo(
+                SELECT = self.__select,
+                ADDRESS = reg, R_WN = 0, DATA = value, ENABLE = 1)
+
+    def __read(self, reg):
+        with self.stats.timing('read'):
+            self.__lmk._write_fields_wo(
+                SELECT = self.__select,
+                ADDRESS = reg, R_WN = 1, ENABLE = 1)
+            return self.__lmk.DATA
+
+    # Forgets the cached SELECT setting, needed if another process may have
+    # used the LMK
+    def invalidate(self):
+        RawLMK._selected.pop(id(self.__lmk), None)
+
+    # Writes any queued writes
+    def flush(self):
+        if self.__queue:
+            queue, self.__queue = self.__queue, []
+            self.__set_select()
+            for reg, value in queue:
+                self.__write(reg, value)
+
+    # Queues writes until the end of the batch
+    @contextlib.contextmanager
+    def batch(self):
+        assert self.__queue is None, 'Batches cannot be nested'
+        self.__queue = []
+        try:
+            yield
+        finally:
+            self.flush()
+            self.__queue = None
 
     def write(self, reg, value):
-        self.__lmk._write_fields_wo(SELECT = self.__select)
-        self.__lmk._write_fields_wo(
-            SELECT = self.__select,
-            ADDRESS = reg, R_WN = 0, DATA = value, ENABLE = 1)
+        if self.__queue is None:
+            self.__set_select()
+            self.__write(reg, value)
+        else:
+            self.__queue.append((reg, value))
 
     def read(self, reg):
-        self.__lmk._write_fields_wo(SELECT = self.__select)
-        self.__lmk._write_fields_wo(
-            SELECT = self.__select,
-            ADDRESS = reg, R_WN = 1, ENABLE = 1)
-        return self.__lmk.DATA
+        self.flush()
+        self.__set_select()
+        return self.__read(reg)
+
+    # Writes a list of (register, value) pairs or a dictionary of values
+    def write_block(self, values):
+        if isinstance(values, dict):
+            values = values.items()
+        self.flush()
+        self.__set_select()
+        for reg, value in values:
+            self.__write(reg, value)
+
+    # Returns a list of the values of the given registers
+    def read_block(self, regs):
+        self.flush()
+        self.__set_select()
+        return [self.__read(reg) for reg in regs]
 
     def reset(self, duration = 0.01):
+        self.flush()
+        # Changing SELECT sets RESET and SYNC to 0, so this write is always
+        # made before asserting reset
         self.__lmk._write_fields_wo(SELECT = self.__select)
+        RawLMK._selected[id(self.__lmk)] = self.__select
         self.__lmk._write_fields_wo(SELECT = self.__select, RESET = 1)
         time.sleep(duration)
         self.__lmk._write_fields_wo(SELECT = self.__select, RESET = 0)
@@ -38,5 +136,14 @@ class LMK04616(devices.LMK04616):
         super().__init__(self.__lmk)
         self._reset = self.__lmk.reset
 
+    def read_block(self, regs):
+        return self.__lmk.read_block(regs)
+
+    def write_block(self, values):
+        self.__lmk.write_block(values)
+
+    def spi_stats(self):
+        return self.__lmk.stats
+
 
-__all__ = ['RawLMK', 'LMK04616']
+__all__ = ['SpiStats', 'RawLMK', 'LMK04616']
@@ -0,0 +1,246 @@
+# Clock frequency monitoring for the LMK test image
+#
+# The LMK test image counts each of 32 clock inputs for 100 ms and publishes
+# the counts in TOP.CLOCK_FREQ, setting TOP.EVENTS.COUNT_UPDATE when they
+# update.  The monitor samples every update into a ring buffer of fixed width
+# arrays, optionally appending each sample to a binary log, and keeps running
+# statistics for each clock together with its deviation in ppm from the
+# expected frequency.  Alerts are raised when a clock moves outside tolerance
+# or is lost, and again when it recovers.
+#
+# Rather than polling continuously, the monitor sleeps until just before the
+# next update is due, so the host load is negligible.
+
+import time
+from collections import namedtuple
+
+import numpy
+
+from .. import regserver
+from .setup_sys_lmk import create_config as create_sys_config
+
+
+# Clock counters in order, see the test clock input assignments in top.vhd
+CLOCK_NAMES = [
+    "SG12 CK",
+    "SG1_WCK",
+    "SG2_WCK",
+    "ACQCLK",
+    "TCLKB",
+    "FMC1_CLK(0)",
+    "FMC1_CLK(1)",
+    "FMC1_CLK(2)",
+    "FMC1_CLK(3)",
+    "FMC2_CLK(0)",
+    "FMC2_CLK(1)",
+    "FMC2_CLK(2)",
+    "FMC2_CLK(3)",
+    "E10G_CLK1",
+    "E10G_CLK2",
+    "E10G_CLK3",
+    "MGT126_CLK0",
+    "MGT227_REFCLK",
+    "MGT229_REFCLK",
+    "MGT230_REFCLK",
+    "MGT127_REFCLK",
+    "MGT232_REFCLK",
+    "RTM_GTP_CLK0_IN",
+    "RTM_GTP_CLK3_IN",
+    "FMC1_GBTCLK(0)",
+    "FMC1_GBTCLK(1)",
+    "FMC1_GBTCLK(2)",
+    "FMC1_GBTCLK(3)",
+    "FMC2_GBTCLK(0)",
+    "FMC2_GBTCLK(1)",
+    "FMC2_GBTCLK(2)",
+    "FMC2_GBTCLK(3)",
+]
+CLOCKS = len(CLOCK_NAMES)
+
+# Counts are over 100 ms intervals
+COUNT_INTERVAL = 0.1
+
+# The SYS LMK VCO frequency, see setup_sys_lmk.py
+VCO_FREQUENCY = 6e9
+
+# SYS LMK output pair driving each clock counter, from the output assignments
+# listed in setup_sys_lmk.py
+SYS_OUTPUTS = {
+    'SG12 CK':          6,      # CLKOUT12: CK to GDDR
+    'SG1_WCK':          4,      # CLKOUT8: WCK_A to GDDR
+    'SG2_WCK':          5,      # CLKOUT10: WCK_B to GDDR
+    'MGT227_REFCLK':    1,      # CLKOUT2
+    'MGT229_REFCLK':    1,      # CLKOUT3
+    'MGT127_REFCLK':    2,      # CLKOUT4
+    'MGT230_REFCLK':    2,      # CLKOUT5
+    'MGT232_REFCLK':    3,      # CLKOUT6
+}
+
+
+# Returns the expected frequency in Hz of each clock counter for the SYS LMK
+# configuration with the given settings, NaN for clocks not driven by the SYS
+# LMK or disabled by the configuration
+def sys_expected(overclock = False, force_refclk = False, refclk_div = 16):
+    config = create_sys_config(overclock, force_refclk, refclk_div)
+    intermediate = VCO_FREQUENCY / config.pll2.d
+    expected = numpy.full(CLOCKS, numpy.nan)
+    for name, output in SYS_OUTPUTS.items():
+        out = config.outputs[output]
+        if out is not None:
+            expected[CLOCK_NAMES.index(name)] = intermediate / out.div
+    return expected
+
+
+# Reads the counts when they update, returns None if the counts have not
+# updated since last read.  Through the register daemon all counts are read in
+# a single request.
+def read_counts(top):
+    if not top.EVENTS.COUNT_UPDATE:
+        return None
+    return numpy.array(
+        regserver.read_values(top.CLOCK_FREQ), dtype = numpy.uint32)
+
+
+# Record written to the binary log for each sample: the sample time followed by
+# the raw count of every clock
+LOG_DTYPE = numpy.dtype([
+    ('time', numpy.float64),
+    ('counts', numpy.uint32, (CLOCKS,)),
+])
+
+# Returns the samples saved in a binary log as an array of LOG_DTYPE
+def read_log(filename):
+    return numpy.fromfile(filename, dtype = LOG_DTYPE)
+
+
+# A change of state of one clock: state is one of 'ok', 'excursion' or 'lost',
+# ppm is the deviation of the sample raising the alert
+Alert = namedtuple('Alert', ['time', 'clock', 'state', 'frequency', 'ppm'])
+
+
+class ClockMonitor:
+    # Monitors the clock counters in top, keeping the last depth samples.
+    # expected is an array of expected frequencies in Hz, with NaN for clocks
+    # which are not checked.  A clock is in excursion if it deviates by more
+    # than tolerance ppm, and is lost if it is below lost_fraction of its
+    # expected frequency.
+    def __init__(self, top, expected, depth = 36000,
+            tolerance = 200, lost_fraction = 0.5, log = None):
+        self.top = top
+        self.expected = numpy.asarray(expected, dtype = numpy.float64)
+        self.checked = ~numpy.isnan(self.expected)
+        self.depth = depth
+        self.tolerance = tolerance
+        self.lost_fraction = lost_fraction
+        self.log = log
+
+        self.times = numpy.zeros(depth)
+        self.counts = numpy.zeros((depth, CLOCKS), dtype = numpy.uint32)
+        self.count = 0
+        self.last_update = None
+
+        # Running statistics in Hz, the variance is accumulated with Welford's
+        # method
+        self.mean = numpy.zeros(CLOCKS)
+        self.m2 = numpy.zeros(CLOCKS)
+        self.min = numpy.full(CLOCKS, numpy.inf)
+        self.max = numpy.full(CLOCKS, -numpy.inf)
+
+        self.state = numpy.full(CLOCKS, 'ok', dtype = object)
+        self.alert_counts = numpy.zeros(CLOCKS, dtype = numpy.int64)
+
+        # Discard any update counted before monitoring started
+        read_counts(top)
+
+    # Waits for the next update and returns its counts.  Sleeps until shortly
+    # before the update is due and then polls.
+    def __wait_counts(self, poll = 0.002):
+        if self.last_update is not None:
+            delay = self.last_update + COUNT_INTERVAL - 0.01 - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        while True:
+            counts = read_counts(self.top)
+            if counts is not None:
+                self.last_update = time.time()
+                return counts
+            time.sleep(poll)
+
+    def ppm(self, frequencies):
+        return 1e6 * (frequencies - self.expected) / self.expected
+
+    # Waits for and records one sample, returns list of Alert for any clocks
+    # which have changed state
+    def sample(self):
+        counts = self.__wait_counts()
+        now = self.last_update
+        index = self.count % self.depth
+        self.times[index] = now
+        self.counts[index] = counts
+        self.count += 1
+        if self.log:
+            record = numpy.array((now, counts), dtype = LOG_DTYPE)
+            self.log.write(record.tobytes())
+
+        frequencies = counts / COUNT_INTERVAL
+        delta = frequencies - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (frequencies - self.mean)
+        self.min = numpy.minimum(self.min, frequencies)
+        self.max = numpy.maximum(self.max, frequencies)
+
+        return self.__check(now, frequencies)
+
+    def __check(self, now, frequencies):
+        with numpy.errstate(invalid = 'ignore'):
+            ppm = self.ppm(frequencies)
+            lost = frequencies < self.lost_fraction * self.expected
+            excursion = numpy.abs(ppm) > self.tolerance
+        state = numpy.where(lost, 'lost',
+            numpy.where(excursion, 'excursion', 'ok'))
+        alerts = []
+        for n in numpy.flatnonzero(self.checked & (state != self.state)):
+            self.state[n] = state[n]
+            if state[n] != 'ok':
+                self.alert_counts[n] += 1
+            alerts.append(Alert(
+                now, CLOCK_NAMES[n], state[n], frequencies[n], ppm[n]))
+        return alerts
+
+    # Returns the times and frequencies of the samples held, oldest first
+    def history(self):
+        held = min(self.count, self.depth)
+        order = (numpy.arange(held) + self.count - held) % self.depth
+        return self.times[order], self.counts[order] / COUNT_INTERVAL
+
+    def std(self):
+        if self.count < 2:
+            return numpy.zeros(CLOCKS)
+        return numpy.sqrt(self.m2 / (self.count - 1))
+
+
+def print_alert(alert):
+    print('%s %-16s %-9s %12.6f MHz %+10.1f ppm' % (
+        time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(alert.time)),
+        alert.clock, alert.state, 1e-6 * alert.frequency, alert.ppm),
+        flush = True)
+
+# Prints the running statistics of the checked clocks, or of all clocks if
+# all_clocks is set
+def print_summary(monitor, all_clocks = False):
+    print('%d samples' % monitor.count)
+    print('%-16s %12s %12s %10s %10s %10s %8s %6s' % (
+        'Clock', 'Expect MHz', 'Mean MHz',
+        'Mean ppm', 'Min ppm', 'Max ppm', 'Std ppm', 'Alerts'))
+    with numpy.errstate(invalid = 'ignore'):
+        mean = monitor.ppm(monitor.mean)
+        low = monitor.ppm(monitor.min)
+        high = monitor.ppm(monitor.max)
+        std = 1e6 * monitor.std() / monitor.expected
+    for n, name in enumerate(CLOCK_NAMES):
+        if monitor.checked[n]:
+            print('%-16s %12.6f %12.6f %+10.1f %+10.1f %+10.1f %8.2f %6d' % (
+                name, 1e-6 * monitor.expected[n], 1e-6 * monitor.mean[n],
+                mean[n], low[n], high[n], std[n], monitor.alert_counts[n]))
+        elif all_clocks:
+            print('%-16s %12s %12.6f' % (name, '-', 1e-6 * monitor.mean[n]))
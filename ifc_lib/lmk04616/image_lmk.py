@@ -0,0 +1,169 @@
+# Cached LMK register images
+#
+# Compiling a configuration with configure_lmk() sets several hundred fields by
+# name, but the resulting register image depends only on the configuration
+# parameters.  Images are therefore compiled once and cached on disk in raw
+# format, named by a hash of the parameters and of the sources used to compile
+# them, so that a change to either compiles a fresh image.
+#
+# Images can be read and written in any of the three formats used by dump-lmk:
+#   names   FIELD = value, one line for every field, values in hex
+#   raw     PLL[register] => value, register and value in hex
+#   ti      R<register> 0x<register><value>, as used by TI TICS Pro
+
+import os
+import re
+import sys
+import json
+import hashlib
+import tempfile
+import functools
+
+from fpga_lib.devices import LMK04616
+
+from .. import defs_path
+from .setup_lmk import device_image, image_device, compile_config
+
+
+__all__ = [
+    'IMAGE_FORMATS', 'load_image', 'format_image', 'save_image',
+    'compare_images', 'image_key', 'cached_image']
+
+IMAGE_FORMATS = ['names', 'raw', 'ti']
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# Image formats
+
+def _input_names(lines):
+    lmk = LMK04616(None)
+    for line in lines:
+        name, value = re.match(r'([^ ]+) = ([^ ]+)', line).groups()
+        setattr(lmk, name, int(value, 16))
+    return device_image(lmk)
+
+def _input_raw(lines):
+    image = {}
+    for line in lines:
+        address, value = re.match(
+            r'PLL\[(...)] (?:=>|=|<=) (..)', line).groups()
+        image[int(address, 16)] = int(value, 16)
+    return image
+
+def _input_ti(lines):
+    image = {}
+    for line in lines:
+        address, addr2, value = re.match(
+            r'R([0-9]+)\s+0x(....)(..)', line).groups()
+        assert int(address) == int(addr2, 16), 'Malformed input line'
+        image[int(address)] = int(value, 16)
+    return image
+
+_INPUT_FORMATS = {
+    'names': _input_names,
+    'raw':   _input_raw,
+    'ti':    _input_ti,
+}
+
+
+def _output_names(image):
+    lmk = image_device(image)
+    return [
+        '%s = %X' % (field, getattr(lmk, field))
+        for field in sorted(lmk._get_fields())]
+
+def _output_raw(image):
+    return ['PLL[%03X] => %02X' % (reg, value) for reg, value in image.items()]
+
+def _output_ti(image):
+    return [
+        'R%d 0x%04X%02X' % (reg, reg, value) for reg, value in image.items()]
+
+_OUTPUT_FORMATS = {
+    'names': _output_names,
+    'raw':   _output_raw,
+    'ti':    _output_ti,
+}
+
+
+# Returns the image held in filename as a dictionary of register values in
+# ascending register order
+def load_image(filename, format = 'raw'):
+    with open(filename) as file:
+        lines = [line for line in file if line.strip()]
+    image = _INPUT_FORMATS[format](lines)
+    return dict(sorted(image.items()))
+
+# Returns the image as a list of lines in the given format
+def format_image(image, format = 'raw'):
+    return _OUTPUT_FORMATS[format](image)
+
+# Writes the image to filename, or to stdout if filename is -
+def save_image(image, filename = '-', format = 'raw'):
+    lines = ''.join(line + '\n' for line in format_image(image, format))
+    if filename == '-':
+        sys.stdout.write(lines)
+    else:
+        with open(filename, 'w') as file:
+            file.write(lines)
+
+
+# Returns list of (register, expected, actual) for registers which differ
+# between two images, with None for a register missing from either image
+def compare_images(expected, actual):
+    return [
+        (reg, expected.get(reg), actual.get(reg))
+        for reg in sorted(set(expected) | set(actual))
+        if expected.get(reg) != actual.get(reg)]
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# Image cache
+
+# Hash of everything other than the configuration parameters which determines
+# the compiled image: the LMK configuration sources in this directory and the
+# fpga_lib LMK04616 field definitions
+@functools.lru_cache(None)
+def _sources_digest():
+    here = os.path.dirname(__file__)
+    sources = [
+        os.path.join(here, name) for name in sorted(os.listdir(here))
+        if name.startswith('setup_') and name.endswith('.py')]
+    sources.append(sys.modules[LMK04616.__module__].__file__)
+    digest = hashlib.sha1()
+    for source in sources:
+        with open(source, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+# Returns the cache key for the image of the named configuration with the
+# given parameters
+def image_key(name, **params):
+    key = json.dumps([name, params, _sources_digest()], sort_keys = True)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+# Returns the image for create_config(**params), compiling and caching it if
+# not already cached.  If the cache cannot be written the image is still
+# returned.
+def cached_image(name, create_config, **params):
+    filename = os.path.join(
+        defs_path.cache_dir(),
+        'lmk-%s-%s.raw' % (name, image_key(name, **params)))
+    try:
+        return load_image(filename)
+    except FileNotFoundError:
+        pass
+
+    image = compile_config(create_config(**params))
+    try:
+        os.makedirs(defs_path.cache_dir(), exist_ok = True)
+        # Write to a temporary file first so that a concurrent reader never
+        # sees a partial image
+        fd, temp = tempfile.mkstemp(
+            dir = defs_path.cache_dir(), prefix = 'lmk-')
+        with os.fdopen(fd, 'w') as file:
+            file.writelines(line + '\n' for line in format_image(image))
+        os.replace(temp, filename)
+    except OSError:
+        pass
+    return image
@@ -1,6 +1,8 @@
 # Module for configuring system LMK
 
 import time
+import contextlib
+from collections import namedtuple
 from typing import Optional, List
 
 from fpga_lib.devices import LMK04616
@@ -247,24 +249,231 @@ def configure_lmk(lmk, config):
     configure_sync(lmk, config.sync_ports)
 
 
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# Waiting for lock
+#
+# Rather than sleeping for the worst case time, the PLL lock status and
+# optionally the measured clock frequencies are polled with an interval
+# starting at LOCK_POLL and doubling up to LOCK_POLL_MAX.  The time taken by
+# each step of setup is recorded as a LockStep in the steps list passed, so that
+# the timeouts can be tuned.
+
+# Recovery time needed after reset, as recommended in a forum posting here:
+# https://e2e.ti.com/support/clock-timing-group/clock-and-timing/f/
+# clock-timing-forum/835700/lmk04616-resetn-recovery-time
+# The LMK cannot be polled until it has recovered, so this is a fixed delay.
+RESET_DELAY = 0.15
+# Width of pulse on GLOBAL_SYNC
+SYNC_PULSE = 0.01
+
+# Time allowed for the PLLs to lock after programming
+LOCK_TIMEOUT = 0.5
+LOCK_POLL = 0.002
+LOCK_POLL_MAX = 0.05
+
+# Time allowed for the clock frequency counters to report the expected
+# frequencies after lock.  The counters update every 100 ms.
+CLOCKS_TIMEOUT = 0.5
+# Allowed relative error in measured clock frequencies
+CLOCKS_TOLERANCE = 1e-3
+
+
+# Records the time taken by one step of setup, the number of times the
+# condition was polled, and whether the step completed
+LockStep = namedtuple('LockStep', ['name', 'seconds', 'polls', 'ok'])
+export(LockStep)
+
+
+@contextlib.contextmanager
+def _timed(steps, name):
+    start = time.time()
+    yield
+    if steps is not None:
+        steps.append(LockStep(name, time.time() - start, 0, True))
+
+
+# Polls condition() with backoff until it returns true or timeout seconds have
+# passed, returns LockStep for the wait
+@export
+def wait_for(name, condition, timeout, steps = None):
+    start = time.time()
+    poll = LOCK_POLL
+    polls = 0
+    while True:
+        polls += 1
+        ok = bool(condition())
+        elapsed = time.time() - start
+        if ok or elapsed >= timeout:
+            break
+        time.sleep(min(poll, timeout - elapsed))
+        poll = min(2 * poll, LOCK_POLL_MAX)
+    step = LockStep(name, elapsed, polls, ok)
+    if steps is not None:
+        steps.append(step)
+    return step
+
+
+# Returns whether the PLLs used by config are locked
+@export
+def plls_locked(lmk, config : Config):
+    return \
+        (config.pll1 is None or bool(lmk.PLL1_LCK_DET)) and \
+        (config.pll2 is None or bool(lmk.PLL2_LCK_DET))
+
+# Waits for the PLLs used by config to lock, returns whether they did
+@export
+def wait_locked(lmk, config : Config, steps = None, timeout = LOCK_TIMEOUT):
+    return wait_for(
+        'pll_lock', lambda: plls_locked(lmk, config), timeout, steps).ok
+
+
+# Returns a dictionary of clock frequencies in Hz for the given CLOCK_FREQ
+# counters, or None if the counters have not updated since last read.  top is a
+# register bank with EVENTS.COUNT_UPDATE and CLOCK_FREQ, as in the LMK test
+# image, where each counter counts for 100 ms.
+@export
+def read_clocks(top, counters):
+    if not top.EVENTS.COUNT_UPDATE:
+        return None
+    return {n: 10 * top.CLOCK_FREQ[n]._value for n in counters}
+
+# Waits for the clocks measured by the counters to reach their expected
+# frequencies, a dictionary of frequencies in Hz indexed by counter.  Returns
+# whether all clocks are within tolerance.
+@export
+def wait_clocks(top, expected, steps = None,
+        timeout = CLOCKS_TIMEOUT, tolerance = CLOCKS_TOLERANCE):
+    # Discard any update counted before the wait started
+    top.EVENTS._value
+    def clocks_ok():
+        clocks = read_clocks(top, expected)
+        return clocks is not None and all(
+            abs(clocks[n] - freq) <= tolerance * freq
+            for n, freq in expected.items())
+    return wait_for('clocks', clocks_ok, timeout, steps).ok
+
+
+# Resets the LMK and programs config.  If the compiled image for config is
+# given it is written directly instead of configuring the LMK field by field.
+# The caller should use wait_locked to wait for lock.
 @export
-def setup_lmk(_lmk, config : Config):
-    # Need to wait for the device to settle after reset as recommended in a
-    # forum posting here: https://e2e.ti.com/support/clock-timing-group/
-    # clock-and-timing/f/clock-timing-forum/835700/lmk04616-resetn-recovery-time
+def setup_lmk(_lmk, config : Config, image = None, steps = None):
     if _lmk:
-        _lmk.reset()
-    time.sleep(0.15)
+        with _timed(steps, 'reset'):
+            _lmk.reset()
+            time.sleep(RESET_DELAY)
 
     # Create the wrapper register interface
     lmk = LMK04616(_lmk)
 
-    configure_lmk(lmk, config)
-    lmk.write_config()
+    with _timed(steps, 'program'):
+        if image is None:
+            configure_lmk(lmk, config)
+            lmk.write_config()
+        elif _lmk:
+            _lmk.write_block(image)
 
     if config.sync_ports and _lmk:
-        lmk.GLOBAL_SYNC = 1
-        time.sleep(0.01)
-        lmk.GLOBAL_SYNC = 0
+        with _timed(steps, 'sync'):
+            if image is None:
+                lmk.GLOBAL_SYNC = 1
+                time.sleep(SYNC_PULSE)
+                lmk.GLOBAL_SYNC = 0
+            else:
+                pulse_sync(_lmk, image)
 
     return lmk
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# Differential programming
+#
+# Rather than resetting the LMK and writing the complete register image, the
+# image for the requested configuration is compared with the registers read
+# back from the LMK and only the registers that differ are written.  If nothing
+# differs and the PLLs are locked the LMK is left alone.
+
+# Returns list of writeable registers
+@export
+def get_registers(lmk):
+    registers = set()
+    for field in lmk._get_fields():
+        for m in lmk._get_field_meta(field):
+            if not m.read_only:
+                registers.add(m.register)
+    return sorted(registers)
+
+
+# Returns the register image of an offline LMK04616 as a dictionary in ascending
+# register order, which is the order in which registers are programmed
+@export
+def device_image(lmk):
+    return {reg: lmk._read_register(reg) for reg in get_registers(lmk)}
+
+# Returns an offline LMK04616 holding the given register image
+@export
+def image_device(image):
+    lmk = LMK04616(None)
+    for reg, value in image.items():
+        lmk._write_register(reg, value)
+    return lmk
+
+
+# Returns the complete register image for config
+@export
+def compile_config(config : Config):
+    lmk = LMK04616(None)
+    configure_lmk(lmk, config)
+    return device_image(lmk)
+
+
+# Returns list of (register, value) for the registers of the LMK which differ
+# from the image for config, in programming order.  The image can be passed if
+# already compiled.
+@export
+def diff_config(_lmk, config : Config, image = None):
+    if image is None:
+        image = compile_config(config)
+    live = _lmk.read_block(list(image))
+    return [
+        (reg, value) for (reg, value), old in zip(image.items(), live)
+        if old != value]
+
+
+# Pulses GLOBAL_SYNC by writing its register directly, leaving the rest of the
+# register as set in image
+def pulse_sync(_lmk, image):
+    lmk = image_device(image)
+    reg = lmk._get_field_meta('GLOBAL_SYNC')[0].register
+    lmk.GLOBAL_SYNC = 1
+    _lmk.write(reg, lmk._read_register(reg))
+    time.sleep(SYNC_PULSE)
+    lmk.GLOBAL_SYNC = 0
+    _lmk.write(reg, lmk._read_register(reg))
+
+
+# Brings the LMK to config by writing only the registers which differ, without
+# a reset.  The compiled image for config and the changes computed by
+# diff_config can be passed if already known.  If the PLLs do not lock within
+# timeout seconds afterwards the LMK is set up from reset with setup_lmk, and
+# the caller should then wait for lock.  Returns the LMK together with the list
+# of registers written, or None if complete setup was needed.
+@export
+def update_lmk(_lmk, config : Config, changes = None, image = None,
+        steps = None, timeout = LOCK_TIMEOUT):
+    if image is None:
+        image = compile_config(config)
+    if changes is None:
+        changes = diff_config(_lmk, config, image)
+    lmk = LMK04616(_lmk)
+    if changes:
+        with _timed(steps, 'program'):
+            _lmk.write_block(changes)
+        if config.sync_ports:
+            with _timed(steps, 'sync'):
+                pulse_sync(_lmk, image)
+
+    if wait_locked(lmk, config, steps, timeout):
+        return (lmk, changes)
+    else:
+        return (setup_lmk(_lmk, config, image, steps), None)
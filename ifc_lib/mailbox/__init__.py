@@ -1,5 +1,6 @@
 # Mailbox support
 
+import sys
 import struct
 from collections import namedtuple
 
@@ -16,10 +17,10 @@ def fail(message):
     raise MailboxError(message)
 
 
-def read_array(mailbox, address, count):
+def read_array(mailbox, message, count):
     result = []
     for n in range(count):
-        mailbox._write_fields_wo(ADDRESS = address + n, WRITE = 0)
+        mailbox._write_fields_wo(MSG_ADDR = message, BYTE_ADDR = n, WRITE = 0)
         result.append(mailbox.DATA)
     return result
 
@@ -0,0 +1,332 @@
+# Register access daemon
+#
+# A long lived daemon can hold the register bindings for a card open and serve
+# register access to tools over a Unix socket, so that each tool does not need
+# to open the device and build its register definitions again.  Requests from
+# concurrent clients are serialised, and a client can send a batch of requests
+# which is run without interruption from other clients.
+#
+# Each message is a line of JSON holding a list of requests, and each request
+# is a list [op, bank, path, arguments...], where bank is the index of the
+# register bank in the tuple returned by bind_ifc_1412.open() and path is the
+# list of names and array indices leading to the register, for example
+# ['AXI', 'STATS', 0].  The reply is a line of JSON with either the list of
+# results or an error.  A client first asks for the layout of the banks, which
+# describes every register, group and array, and builds matching objects.
+
+import os
+import json
+import socket
+import tempfile
+import threading
+import contextlib
+import socketserver
+
+
+class RegisterError(Exception):
+    pass
+
+
+# Returns the socket used for the card at address.  The directory can be set
+# with $IFC_1412_REGS_DIR
+def socket_path(address = 0):
+    directory = os.environ.get('IFC_1412_REGS_DIR', tempfile.gettempdir())
+    return os.path.join(directory, 'ifc_1412-regs-%s.sock' % address)
+
+
+# ------------------------------------------------------------------------------
+# Server
+
+def _fields_dict(fields):
+    if hasattr(fields, '_asdict'):
+        values = fields._asdict()
+    else:
+        values = vars(fields)
+    return {
+        name: int(value) for name, value in values.items()
+        if not name.startswith('_')}
+
+def _read(register):
+    return int(register._value)
+
+def _read_n(register, count):
+    return [int(register._value) for _ in range(count)]
+
+def _write(register, value):
+    register._value = value
+
+def _get(register, field):
+    return int(getattr(register, field))
+
+def _set(register, field, value):
+    setattr(register, field, value)
+
+def _write_wo(register, fields):
+    register._write_fields_wo(**fields)
+
+def _write_rw(register, fields):
+    register._write_fields_rw(**fields)
+
+def _get_fields(register):
+    return _fields_dict(register._get_fields())
+
+_OPERATIONS = {
+    'read':     _read,
+    'read_n':   _read_n,
+    'write':    _write,
+    'get':      _get,
+    'set':      _set,
+    'write_wo': _write_wo,
+    'write_rw': _write_rw,
+    'fields':   _get_fields,
+}
+
+
+# Returns the names of the registers and groups in a bank or group
+def register_names(bank):
+    return [
+        name for name in dir(bank)
+        if name.isupper() and not name.startswith('_')]
+
+
+def _is_array(item):
+    return isinstance(item, (list, tuple)) or (
+        hasattr(item, '__len__') and hasattr(item, '__getitem__'))
+
+# Returns a description of a register group as a dictionary mapping the name of
+# each member to None for a register, a list of descriptions for an array, or a
+# dictionary for a nested group.  Registers are recognised by their field
+# access methods so that no register is read.
+def describe(group):
+    return {
+        name: _describe(getattr(group, name))
+        for name in register_names(group)}
+
+def _describe(item):
+    if hasattr(item, '_write_fields_wo'):
+        return None
+    elif _is_array(item):
+        return [_describe(member) for member in item]
+    else:
+        return describe(item)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                requests = json.loads(line)
+                with self.server.lock:
+                    results = [
+                        self.server.execute(*request) for request in requests]
+                reply = {'results': results}
+            except Exception as e:
+                reply = {'error': '%s: %s' % (type(e).__name__, e)}
+            self.wfile.write(json.dumps(reply).encode() + b'\n')
+
+
+# Serves the given tuple of register banks, as returned by
+# bind_ifc_1412.open(), on the socket at path
+class RegisterServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, banks):
+        self.path = path
+        self.banks = banks
+        self.lock = threading.Lock()
+        # Remove a socket left behind by a daemon which has gone
+        if os.path.exists(path):
+            assert connect_path(path) is None, \
+                'Register daemon already running on %s' % path
+            os.unlink(path)
+        super().__init__(path, _Handler)
+
+    def execute(self, op, *args):
+        if op == 'banks':
+            return [
+                None if bank is None else describe(bank)
+                for bank in self.banks]
+        bank, path, *args = args
+        register = self.banks[bank]
+        for step in path:
+            if isinstance(step, int):
+                register = register[step]
+            else:
+                register = getattr(register, step)
+        return _OPERATIONS[op](register, *args)
+
+    def server_close(self):
+        super().server_close()
+        os.unlink(self.path)
+
+
+# ------------------------------------------------------------------------------
+# Client
+
+class _Connection:
+    def __init__(self, sock):
+        self.file = sock.makefile('rwb')
+        self.pending = None
+
+    def __send(self, requests):
+        # Values written may be numpy integers
+        self.file.write(json.dumps(requests, default = int).encode() + b'\n')
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise RegisterError('Register daemon closed connection')
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise RegisterError(reply['error'])
+        return reply['results']
+
+    # Sends a request and returns its result.  Inside a batch requests with no
+    # result are held back and sent with the next request needing a result
+    def call(self, request, result = True):
+        if self.pending is None:
+            return self.__send([request])[0]
+        elif result:
+            requests, self.pending = self.pending + [request], []
+            return self.__send(requests)[-1]
+        else:
+            self.pending.append(request)
+
+    # Sends a list of requests in a single message and returns their results,
+    # together with any requests held back in a batch
+    def call_many(self, requests):
+        if self.pending:
+            pending, self.pending = self.pending, []
+            return self.__send(pending + requests)[len(pending):]
+        else:
+            return self.__send(requests)
+
+    # Within a batch writes are sent together, and are run by the daemon
+    # without interruption from other clients.  Note that any delays between
+    # writes in the batch are lost.
+    @contextlib.contextmanager
+    def batch(self):
+        assert self.pending is None, 'Batches cannot be nested'
+        self.pending = []
+        try:
+            yield
+        finally:
+            pending, self.pending = self.pending, None
+            if pending:
+                self.__send(pending)
+
+
+# Field values returned by _get_fields()
+class _Fields:
+    def __init__(self, values):
+        self._field_names = list(values)
+        self.__dict__.update(values)
+
+    def __repr__(self):
+        return ', '.join(
+            '%s=%d' % (name, getattr(self, name))
+            for name in self._field_names)
+
+
+# A register accessed through the daemon, supporting the same access methods as
+# the fpga_lib registers
+class RemoteRegister:
+    def __init__(self, connection, bank, path):
+        self.__dict__.update(_connection = connection, _request = [bank, path])
+
+    def __call(self, op, *args, result = True):
+        return self._connection.call([op] + self._request + list(args), result)
+
+    @property
+    def _value(self):
+        return self.__call('read')
+
+    @_value.setter
+    def _value(self, value):
+        self.__call('write', value, result = False)
+
+    # Reads the register count times in a single request
+    def _read_values(self, count):
+        return self.__call('read_n', count)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.__call('get', name)
+
+    def __setattr__(self, name, value):
+        if name == '_value':
+            object.__setattr__(self, name, value)
+        else:
+            self.__call('set', name, value, result = False)
+
+    def _get_fields(self):
+        return _Fields(self.__call('fields'))
+
+    def _write_fields_wo(self, **fields):
+        self.__call('write_wo', fields, result = False)
+
+    def _write_fields_rw(self, **fields):
+        self.__call('write_rw', fields, result = False)
+
+
+# Returns the remote object for the description of a register, array or group
+def _remote(connection, bank, path, description):
+    if description is None:
+        return RemoteRegister(connection, bank, path)
+    elif isinstance(description, list):
+        return tuple(
+            _remote(connection, bank, path + [n], member)
+            for n, member in enumerate(description))
+    else:
+        return RemoteGroup(connection, bank, path, description)
+
+
+# A group of registers accessed through the daemon.  Arrays of registers are
+# tuples, so can be indexed and iterated.
+class RemoteGroup:
+    def __init__(self, connection, bank, path, description):
+        for name, member in description.items():
+            setattr(self, name,
+                _remote(connection, bank, path + [name], member))
+
+
+class RemoteBank(RemoteGroup):
+    def __init__(self, connection, bank, description):
+        super().__init__(connection, bank, [], description)
+        self._connection = connection
+
+    # Returns a context manager for sending a batch of requests
+    def _batch(self):
+        return self._connection.batch()
+
+
+# Returns the values of a list of registers.  Registers served by the daemon
+# are read in a single request.
+def read_values(registers):
+    registers = list(registers)
+    if registers and isinstance(registers[0], RemoteRegister):
+        return registers[0]._connection.call_many([
+            ['read'] + register._request for register in registers])
+    else:
+        return [register._value for register in registers]
+
+
+# Returns the tuple of register banks served on path, or None if no daemon is
+# running there
+def connect_path(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+    connection = _Connection(sock)
+    return tuple(
+        None if description is None
+        else RemoteBank(connection, bank, description)
+        for bank, description in enumerate(connection.call(['banks'])))
+
+# Returns the register banks for the card at address from the daemon, or None
+# if no daemon is running for this card
+def connect(address = 0):
+    return connect_path(socket_path(address))
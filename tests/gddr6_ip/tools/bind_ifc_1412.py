@@ -1,28 +1,38 @@
 # Defines mapping to test-gddr6 registers
 
 import os
-import numpy
 
 from ifc_lib import defs_path
-from fpga_lib.driver import driver
+from ifc_lib import regserver
 
-class Registers(driver.RawRegisters):
-    NAME = 'ifc_1412-gddr6'
-    REGS_RANGE = numpy.s_[:1024]
-    SG_RANGE   = numpy.s_[1024:]
+# fpga_lib and numpy are only imported when the card is opened directly, so that
+# a tool served by the register daemon does not load them
+def open_device(addr = 0):
+    import numpy
+    from fpga_lib.driver import driver
 
-    def __init__(self, address = 0):
-        super().__init__(self.NAME, address)
+    class Registers(driver.RawRegisters):
+        NAME = 'ifc_1412-gddr6'
+        REGS_RANGE = numpy.s_[:1024]
+        SG_RANGE   = numpy.s_[1024:]
 
-        register_defines = defs_path.register_defines(__file__)
-        gddr6_defines = defs_path.module_defines('gddr6')
-        lmk04616_defines = defs_path.module_defines('lmk04616')
-        self.make_registers('SYS', self.REGS_RANGE,
-            lmk04616_defines, register_defines)
-        self.make_registers('GDDR6', self.SG_RANGE, gddr6_defines)
+        def __init__(self, address = 0):
+            super().__init__(self.NAME, address)
+
+            register_defines = defs_path.register_defines(__file__)
+            gddr6_defines = defs_path.module_defines('gddr6')
+            lmk04616_defines = defs_path.module_defines('lmk04616')
+            self.make_registers('SYS', self.REGS_RANGE,
+                lmk04616_defines, register_defines)
+            self.make_registers('GDDR6', self.SG_RANGE, gddr6_defines)
 
-def open(addr = 0):
     regs = Registers(addr)
     return (regs.SYS, regs.GDDR6)
 
-__all__ = ['open']
+# Every access through the register daemon is a round trip over its socket, so
+# only tools making few accesses, such as status and monitoring tools, should
+# set daemon to use it if one is running.  Other tools open the card directly.
+def open(addr = 0, daemon = False):
+    return daemon and regserver.connect(addr) or open_device(addr)
+
+__all__ = ['open', 'open_device']
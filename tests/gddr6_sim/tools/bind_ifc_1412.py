@@ -0,0 +1,39 @@
+# Binds the tools to a software simulation of the GDDR6 PHY and SGRAM
+#
+# The simulation state is saved between runs so that a sequence of tools, such
+# as setup-sgram, all see the same simulated card.  The state file is given by
+# $GDDR6_SIM_STATE or defaults to a file in /tmp named after the card address,
+# and a new simulation is seeded from $GDDR6_SIM_SEED.
+
+import os
+import atexit
+import tempfile
+
+from ifc_lib import regserver
+from ifc_lib.gddr6_lib import sim
+
+
+def state_file(addr = 0):
+    return os.environ.get('GDDR6_SIM_STATE', os.path.join(
+        tempfile.gettempdir(), 'gddr6-sim-%s.pickle' % addr))
+
+# Loads the simulation and arranges for its state to be saved on exit
+def open_simulation(addr = 0):
+    filename = state_file(addr)
+    seed = int(os.environ.get('GDDR6_SIM_SEED', 0))
+    simulation = sim.Simulation.load(filename, seed)
+    atexit.register(simulation.save, filename)
+    return simulation
+
+def open_device(addr = 0):
+    return (None, open_simulation(addr).registers())
+
+# Unlike a real card, the simulation state is held by the process which opened
+# it and is only saved on exit, so a tool opening the simulation directly while
+# the register daemon is running would work on a stale copy and its changes
+# would later be overwritten by the daemon.  The daemon is therefore always used
+# if it is running, whatever daemon is set to.
+def open(addr = 0, daemon = False):
+    return regserver.connect(addr) or open_device(addr)
+
+__all__ = ['open', 'open_device']
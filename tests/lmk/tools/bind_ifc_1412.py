@@ -3,20 +3,30 @@
 # Must provide open() method returning registers for TOP and GDDR6 (if present)
 
 from ifc_lib import defs_path
-from fpga_lib.driver import driver
+from ifc_lib import regserver
 
-class Registers(driver.RawRegisters):
-    NAME = 'ifc_1412-lmk'
+# fpga_lib is only imported when the card is opened directly, so that a tool
+# served by the register daemon does not load it
+def open_device(addr = 0):
+    from fpga_lib.driver import driver
 
-    def __init__(self, address = 0):
-        super().__init__(self.NAME, address)
+    class Registers(driver.RawRegisters):
+        NAME = 'ifc_1412-lmk'
 
-        register_defines = defs_path.register_defines(__file__)
-        lmk04616_defines = defs_path.module_defines('lmk04616')
-        self.make_registers('TOP', None, lmk04616_defines, register_defines)
+        def __init__(self, address = 0):
+            super().__init__(self.NAME, address)
+
+            register_defines = defs_path.register_defines(__file__)
+            lmk04616_defines = defs_path.module_defines('lmk04616')
+            self.make_registers('TOP', None, lmk04616_defines, register_defines)
 
-def open(addr = 0):
     regs = Registers(addr)
     return (regs.TOP, None)
 
-__all__ = ['open']
+# Every access through the register daemon is a round trip over its socket, so
+# only tools making few accesses, such as status and monitoring tools, should
+# set daemon to use it if one is running.  Other tools open the card directly.
+def open(addr = 0, daemon = False):
+    return daemon and regserver.connect(addr) or open_device(addr)
+
+__all__ = ['open', 'open_device']